@@ -7,56 +7,145 @@ app package will host the application'''
 
 
 from flask import Flask
-# Import SQLAlchemy and Migrate to work with the DB
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+# Import SQLAlchemy to work with the DB. RoutingSQLAlchemy is SQLAlchemy with
+# a session that can read from replicas
+from app.replicas import RoutingSQLAlchemy, Replicas
 # Import Login manager from flask_login extension which manages the user logged-in state
 # with this the app remembers if the user is logged in. Also provides a "remember me"
 # functionality that allows users to remain logged in even after clossing the browser
 # window
 from flask_login import LoginManager
+# Pool and SQLite pragmas of the database engine, and Flask-Migrate loaded
+# only by the flask db commands
+from app.database import init_engine, LazyMigrate
+# Batched writes of user.last_seen
+from app.last_seen import LastSeenTracker
+# Cache in front of the Flask-Login user loader
+from app.user_cache import UserCache
+# Full-text search of the posts
+from app.fulltext import Search, include_object
+# Cache of the rendered _post.html fragments
+from app.fragments import FragmentCache
+# Compiled templates stored on disk, shared by the processes
+from app.template_cache import TemplateCache
+# Batched inserts of the new posts
+from app.post_writer import PostWriter
+# Query counts and timings of the requests, served at /metrics
+from app.metrics import Metrics
+# Limits of the login and registration attempts
+from app.rate_limit import RateLimiter
+# Signed bearer tokens for the API
+from app.tokens import TokenAuth
 # Import class Config from module config
 from config import Config
-# Flask uses python's logging package to write its logs and send the logs by email
-import logging
-# To send out error I add SMTPHandler instance to the Flask logger object, which 
+# Flask uses python's logging package to write its logs and send the logs by email.
+# To send out errors ErrorMail adds a handler to the Flask logger object, which
 # is app.logger
-from logging.handlers import SMTPHandler
-
-
-app = Flask(__name__) #1 app here is an instance of the class Flask
-#Tell Flask to read and apply the config file
-app.config.from_object(Config)
-# Create and instance of the DB Class and the Migrate Class
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-# Initialize the LoginManager after the app instance. Flask-Login needs to know what
-# is the view function that handles logins
-login = LoginManager(app)
-# 'login' is the function or endpoint name for the login view, the name
-# we would use in a url_for() call to get the URL
-login.login_view = 'login'
-
-# To send out errors
-if not app.debug:
-    if app.config['MAIL_SERVER']:
-        auth = None
-        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        secure = None
-        if app.config['MAIL_USE_TLS']:
-            secure = ()
-        mail_handler = SMTPHandler(
-            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-            fromaddr='no-reply@' + app.config['MAIL_SERVER'],
-            toaddrs=app.config['ADMINS'], subject='Microblog Failure',
-            credentials=auth, secure=secure)
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
-
-
-# It's done here to avoid circular imports
-# Routes is a py module inside app folder (package). Here to avoid circular imports
+from app.error_mail import ErrorMail
+
+
+# The extensions are created here without an application, create_app()
+# attaches them to each application it builds. None of them opens a
+# connection or starts a thread before it's used: the database engine, the
+# replica engines, Alembic and the background threads all wait for their
+# first request or command
+db = RoutingSQLAlchemy()
+# Read replicas from DATABASE_REPLICA_URLS, none by default
+replicas = Replicas()
+# include_object keeps the search index tables out of the autogenerated migrations
+migrate = LazyMigrate(include_object=include_object)
+login = LoginManager()
+# 'auth.login' is the endpoint name for the login view, the name we would use
+# in a url_for() call to get the URL. Flask-Login redirects there
+login.login_view = 'auth.login'
+# Buffers the last_seen updates of the users and writes them in batches
+last_seen = LastSeenTracker()
+# Keeps recently seen users so loading current_user doesn't query the DB
+user_cache = UserCache()
+# API tokens checked without the database, the user comes from user_cache
+tokens = TokenAuth()
+# Inverted index of the post bodies, kept up to date by the Post model events
+search = Search()
+# Templates call render_post(post) instead of including _post.html
+fragments = FragmentCache()
+# New processes load the compiled templates instead of compiling them
+template_cache = TemplateCache()
+# New posts are committed in groups by a background thread
+post_writer = PostWriter()
+metrics = Metrics()
+# Login and registration attempts over the limits get a 429, before any query
+rate_limit = RateLimiter()
+# To send out errors. The emails are sent from a background thread, identical
+# errors are grouped and the queue is bounded
+error_mail = ErrorMail()
+
+
+def create_app(config_class=Config):
+    """Application factory
+
+    Args:
+        config_class (class, optional): configuration to apply. Defaults to Config
+
+    Returns:
+        Flask: a new application
+    """
+    app = Flask(__name__) #1 app here is an instance of the class Flask
+    #Tell Flask to read and apply the config file
+    app.config.from_object(config_class)
+
+    # WAL mode and the other pragmas for SQLite, a connection pool for the others
+    init_engine(app)
+    db.init_app(app)
+    replicas.init_app(app, db)
+    migrate.init_app(app, db)
+    login.init_app(app)
+    last_seen.init_app(app)
+    user_cache.init_app(app)
+    tokens.init_app(app)
+    search.init_app(app, db)
+    fragments.init_app(app)
+    template_cache.init_app(app)
+    post_writer.init_app(app)
+    # Hooked first so the timings include the other before/after request functions
+    metrics.init_app(app)
+    # Before everything that could query the database or hash a password
+    rate_limit.init_app(app)
+    error_mail.init_app(app)
+    # The counters of the caches and buffers are shown in /metrics too
+    metrics.register('user_cache', user_cache.stats,
+                     counters=('hits', 'misses', 'invalidations'), app=app)
+    metrics.register('fragment_cache', fragments.stats,
+                     counters=('hits', 'misses', 'evictions'), app=app)
+    metrics.register('last_seen', last_seen.stats,
+                     counters=('flushes', 'written', 'failures'), app=app)
+    metrics.register('error_mail', error_mail.stats,
+                     counters=('sent', 'coalesced', 'dropped'), app=app)
+    metrics.register('replicas', replicas.stats,
+                     counters=('primary_reads', 'replica_reads', 'failures'), app=app)
+    metrics.register('post_writer', post_writer.stats,
+                     counters=('batches', 'posts', 'failures', 'timeouts'), app=app)
+    metrics.register('rate_limit', rate_limit.stats,
+                     counters=('allowed', 'rejected', 'rejected_ip', 'rejected_username'), app=app)
+
+    # Each part of the application is a blueprint. They are imported here to
+    # avoid circular imports, they import the extensions above
+    # errors is where we handle errors
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+    # login, logout and registration
+    from app.auth import bp as auth_bp
+    app.register_blueprint(auth_bp)
+    # timelines, profiles, search and avatars
+    from app.main import bp as main_bp
+    app.register_blueprint(main_bp)
+    # JSON API under /api/v1
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp)
+    # cli.py adds our own commands to the flask command
+    from app.cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
+    return app
+
+
 # models.py is where we create the DB logic
-# errors.py is where we handle errors
-from app import routes, models, errors
\ No newline at end of file
+from app import models
\ No newline at end of file
@@ -0,0 +1,259 @@
+"""JSON API
+  /api/v1 serves the profiles and the timelines as JSON, for the mobile
+  clients and the data jobs. The rows are read as plain column tuples with
+  Core select() statements: no ORM objects are built and no template is
+  rendered.
+  The lists are pages of API_PER_PAGE posts (?limit= up to API_MAX_PER_PAGE)
+  with the URL of the next page, paginated with the same cursors as the HTML
+  pages. With "Accept: application/x-ndjson" the whole list from ?before= on
+  is streamed instead, one JSON post per line, read from the database
+  API_STREAM_CHUNK rows at a time: an export of any size uses the memory of
+  one chunk.
+  The calls authenticate with the session cookie of the site or with a
+  token from POST /api/v1/tokens, see app/tokens.py.
+  The functions that build the statements (user_select, posts_select,
+  posts_by_id_select) don't run them, other code paths can execute them too.
+"""
+import json
+from functools import wraps
+from flask import Blueprint, Response, abort, current_app, jsonify, request, \
+    stream_with_context, url_for
+from flask_login import current_user
+from werkzeug.http import HTTP_STATUS_CODES
+from app import db, last_seen, tokens
+from app.models import User, Post, avatar_url
+from app.pagination import decode_cursor, encode_cursor, keyset_select
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+NDJSON = 'application/x-ndjson'
+# Size of the avatar URLs in the posts
+AVATAR_SIZE = 36
+
+
+def user_select(username):
+    """Columns of the profile of a user"""
+    return db.select(User.id, User.username, User.about_me, User.last_seen,
+                     User.follower_count, User.email_hash) \
+        .where(User.username == username)
+
+
+def _posts_with_author():
+    return db.select(Post.id, Post.body, Post.timestamp, User.username,
+                     User.email_hash).join(User, Post.user_id == User.id)
+
+
+def posts_select(user_id, before, limit):
+    """Newest posts of a user older than the before cursor, through the
+    (user_id, timestamp, id) index"""
+    return keyset_select(_posts_with_author().where(Post.user_id == user_id),
+                         Post.timestamp, Post.id, before, limit)
+
+
+def posts_by_id_select(ids):
+    """Posts with these ids, in no particular order"""
+    return _posts_with_author().where(Post.id.in_(ids))
+
+
+def _time(value):
+    # The timestamps are naive UTC datetimes
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+def user_json(row, seen):
+    return {'id': row.id, 'username': row.username, 'about_me': row.about_me,
+            'last_seen': _time(seen), 'follower_count': row.follower_count,
+            'avatar': avatar_url(row.email_hash, 128),
+            'posts': url_for('api.get_user_posts', username=row.username)}
+
+
+def post_json(row):
+    return {'id': row.id, 'body': row.body, 'timestamp': _time(row.timestamp),
+            'author': {'username': row.username,
+                       'avatar': avatar_url(row.email_hash, AVATAR_SIZE)}}
+
+
+def error_response(status, message=None):
+    payload = {'error': HTTP_STATUS_CODES.get(status, 'Unknown error')}
+    if message:
+        payload['message'] = message
+    response = jsonify(payload)
+    response.status_code = status
+    return response
+
+
+@bp.errorhandler(400)
+@bp.errorhandler(404)
+def http_error(error):
+    return error_response(error.code)
+
+
+@bp.errorhandler(429)
+def too_many_requests(error):
+    # Raised by app/rate_limit.py, Retry-After says when to try again
+    response = error_response(429)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def api_login_required(f):
+    """Like flask_login.login_required, with a 401 JSON answer instead of a
+    redirect to the login page"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return error_response(401)
+        return f(*args, **kwargs)
+    return decorated
+
+
+def split_page(rows, limit):
+    """Rows of a page read with one extra row, the extra row tells if there
+    is a next page
+
+    Returns:
+        tuple: (rows, cursor of the next page or None)
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1].timestamp, rows[-1].id)
+    return rows, None
+
+
+def in_key_order(keys, rows):
+    """Rows of posts_by_id_select() in the order of the timeline keys"""
+    by_id = {row.id: row for row in rows}
+    return [by_id[id] for _, id in keys if id in by_id]
+
+
+def user_posts_page(user_id, before, limit):
+    """One page of the posts of a user
+
+    Returns:
+        tuple: (rows, cursor of the next page or None)
+    """
+    return split_page(db.session.execute(
+        posts_select(user_id, before, limit + 1)).all(), limit)
+
+
+def timeline_page(user, before, limit):
+    """One page of the home timeline of a user
+
+    Returns:
+        tuple: (rows, cursor of the next page or None)
+    """
+    keys = user.timeline_keys(before, limit + 1)
+    next_cursor = keys[limit - 1] if len(keys) > limit else None
+    keys = keys[:limit]
+    return in_key_order(keys, db.session.execute(
+        posts_by_id_select([id for _, id in keys]))), next_cursor
+
+
+def request_cursor():
+    """Decoded ?before= cursor of the request, 400 when it's malformed"""
+    try:
+        return decode_cursor(request.args.get('before'))
+    except ValueError:
+        abort(400)
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def request_limit():
+    """?limit= of the request, within 1 and API_MAX_PER_PAGE"""
+    limit = request.args.get('limit', current_app.config['API_PER_PAGE'], type=int)
+    return max(1, min(limit, current_app.config['API_MAX_PER_PAGE']))
+
+
+def page_json(rows, next_cursor, limit, endpoint, **values):
+    """Body of a page of posts, with the URL of the next page"""
+    next_url = url_for(endpoint, before=encode_cursor(*next_cursor), limit=limit,
+                       **values) if next_cursor else None
+    return {'items': [post_json(row) for row in rows], 'next': next_url}
+
+
+def ndjson_lines(rows):
+    return ''.join(json.dumps(post_json(row)) + '\n' for row in rows)
+
+
+def _posts_response(fetch, endpoint, **values):
+    """Answer with a page of posts or with all of them as NDJSON
+
+    Args:
+        fetch (callable): fetch(before, limit) returns (rows, next cursor)
+        endpoint (str): endpoint of the view, for the URL of the next page
+        values: arguments of the endpoint URL
+    """
+    before = request_cursor()
+    if wants_ndjson():
+        chunk = current_app.config['API_STREAM_CHUNK']
+
+        def generate(cursor):
+            # A keyset page per chunk, no query stays open between chunks
+            while True:
+                rows, cursor = fetch(cursor, chunk)
+                yield ndjson_lines(rows)
+                if cursor is None:
+                    return
+        # The generator runs after the view returns, stream_with_context
+        # keeps the request (and the database session) around for it
+        return Response(stream_with_context(generate(before)), mimetype=NDJSON)
+    limit = request_limit()
+    rows, next_cursor = fetch(before, limit)
+    return jsonify(page_json(rows, next_cursor, limit, endpoint, **values))
+
+
+@bp.route('/tokens', methods=['POST'])
+def get_token():
+    """Exchange a username and password (HTTP Basic) for a token. The only
+    call that checks a password, the token is used for the others"""
+    auth = request.authorization
+    if auth is None or not auth.username or not auth.password:
+        return error_response(401)
+    user = User.query.filter_by(username=auth.username).first()
+    if user is None or not user.check_password(auth.password):
+        return error_response(401)
+    return jsonify({'token': tokens.issue(user),
+                    'expires_in': current_app.config['API_TOKEN_EXPIRATION']})
+
+
+@bp.route('/tokens', methods=['DELETE'])
+@api_login_required
+def revoke_tokens():
+    """Revoke all the tokens of the current user"""
+    current_user.token_version = User.token_version + 1
+    db.session.commit()
+    return '', 204
+
+
+@bp.route('/users/<username>')
+@api_login_required
+def get_user(username):
+    row = db.session.execute(user_select(username)).first()
+    if row is None:
+        abort(404)
+    # The last visit can still be in the tracker buffer
+    return jsonify(user_json(row, last_seen.last_seen(row)))
+
+
+@bp.route('/users/<username>/posts')
+@api_login_required
+def get_user_posts(username):
+    user_id = db.session.execute(
+        db.select(User.id).where(User.username == username)).scalar()
+    if user_id is None:
+        abort(404)
+    return _posts_response(
+        lambda before, limit: user_posts_page(user_id, before, limit),
+        'api.get_user_posts', username=username)
+
+
+@bp.route('/timeline')
+@api_login_required
+def get_timeline():
+    user = current_user._get_current_object()
+    return _posts_response(
+        lambda before, limit: timeline_page(user, before, limit),
+        'api.get_timeline')
@@ -0,0 +1,305 @@
+"""ASGI serving mode
+  Under an ASGI server the profile, posts and timeline calls of the API run
+  on the event loop with an async SQLAlchemy engine (aiosqlite for SQLite):
+  while a query waits for the database the process serves other requests,
+  no thread is held by a waiting request.
+  Everything else (the HTML pages, the forms, the writes, the API calls made
+  with the session cookie of the site) goes to the Flask application, run in
+  a pool of ASGI_THREADS threads, so every WSGI view keeps working as it is.
+  The async calls build the same statements and the same JSON as the views
+  of app/api.py and accept the same bearer tokens. The token's user is read
+  with one query on the async engine instead of the user cache, and the
+  reads go to the primary database, not to the read replicas.
+
+  $ pip install uvicorn aiosqlite
+  $ uvicorn asgi:application --port 8000
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import abort, jsonify, request
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+from app import db, last_seen, tokens
+from app.api import user_select, posts_select, posts_by_id_select, user_json, \
+    error_response, split_page, in_key_order, request_cursor, wants_ndjson, \
+    request_limit, page_json, ndjson_lines
+from app.database import async_engine_options, async_url, tune_engine
+from app.models import User, timeline_entries_select, high_fanout_followed_select, \
+    post_keys_select, merge_timeline_keys
+from app.tokens import bearer_token
+
+
+def wsgi_environ(scope):
+    """WSGI environ of an ASGI HTTP request, without wsgi.input
+
+    Args:
+        scope (dict): ASGI connection scope
+
+    Returns:
+        dict: the environ
+    """
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI strings are bytes decoded as latin-1
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'] = server[0]
+    environ['SERVER_PORT'] = str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            # Repeated headers are joined, cookies with their own separator
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    return environ
+
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        body.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(body)
+
+
+async def timeline_keys(connection, user_id, before, limit):
+    """User.timeline_keys() on an async connection"""
+    pushed = (await connection.execute(
+        timeline_entries_select(user_id, before, limit))).all()
+    pulled = []
+    authors = (await connection.execute(high_fanout_followed_select(user_id))).scalars()
+    for author_id in authors.all():
+        pulled += (await connection.execute(
+            post_keys_select(author_id, before, limit))).all()
+    return merge_timeline_keys(pushed, pulled, limit)
+
+
+class AsyncApp(object):
+    """ASGI application around a Flask application
+
+    Args:
+        app (Flask): application built by create_app()
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'],
+                                           thread_name_prefix='wsgi')
+        # Created on first use, inside the event loop of the server
+        self._engine = None
+        # Endpoints of app/api.py served here
+        self.views = {'api.get_user': self.get_user,
+                      'api.get_user_posts': self.get_user_posts,
+                      'api.get_timeline': self.get_timeline}
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            config = self.app.config
+            uri = config['SQLALCHEMY_DATABASE_URI']
+            self._engine = create_async_engine(
+                config['ASYNC_DATABASE_URL'] or async_url(uri),
+                **async_engine_options(uri, config))
+            # Same pragmas as the engine of the WSGI views
+            tune_engine(self._engine.sync_engine, config)
+        return self._engine
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope {}'.format(scope['type']))
+        environ = wsgi_environ(scope)
+        view = self.match(environ)
+        if view is not None and await self.dispatch(view, environ, send):
+            return
+        environ['wsgi.input'] = io.BytesIO(await read_body(receive))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.call_wsgi, environ, send, loop)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._engine is not None:
+                    await self._engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def match(self, environ):
+        """Async view and URL arguments of a request, or None"""
+        if environ['REQUEST_METHOD'] != 'GET':
+            return None
+        try:
+            endpoint, values = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # 404, 405 and redirects are answered by Flask
+            return None
+        view = self.views.get(endpoint)
+        return (view, values) if view is not None else None
+
+    async def dispatch(self, view, environ, send):
+        """Run an async view
+
+        Returns:
+            bool: False when the request has no bearer token and must go to
+                the WSGI views, which handle the session cookie
+        """
+        view, values = view
+        with self.app.request_context(environ):
+            token = bearer_token(request)
+            if token is None:
+                return False
+            try:
+                async with self.engine.connect() as connection:
+                    user = await self.authenticate(connection, token)
+                    if user is None:
+                        response = error_response(401)
+                    else:
+                        response = await view(connection, user, **values)
+            except HTTPException as error:
+                response = error_response(error.code)
+            except Exception:
+                # Logged like Flask does it, the error emails include them
+                self.app.log_exception(sys.exc_info())
+                response = error_response(500)
+            await self.send_response(response, send)
+        return True
+
+    async def authenticate(self, connection, token):
+        identity = tokens.verify(token)
+        if identity is None:
+            return None
+        user_id, version = identity
+        user = (await connection.execute(db.select(
+            User.id, User.last_seen, User.token_version).where(User.id == user_id))).first()
+        # An older version means the token was revoked
+        if user is None or user.token_version != version:
+            return None
+        if last_seen.record(user):
+            # The flush writes with the sync engine, in a thread
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.flush_last_seen)
+        return user
+
+    def flush_last_seen(self):
+        with self.app.app_context():
+            last_seen.flush()
+
+    async def send_response(self, response, send):
+        """Send a Flask response, or the chunks of an async generator as NDJSON"""
+        if not hasattr(response, 'status_code'):
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'application/x-ndjson')]})
+            async for chunk in response:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send({'type': 'http.response.start', 'status': response.status_code,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in response.headers.items()]})
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    def call_wsgi(self, environ, send, loop):
+        """Run the Flask application in a thread of the pool, its response
+        is sent by the event loop chunk by chunk"""
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start.update(type='http.response.start', status=int(status.split(' ', 1)[0]),
+                         headers=[(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers])
+
+        iterable = self.app(environ, start_response)
+        started = False
+        try:
+            for data in iterable:
+                if not started:
+                    emit(start)
+                    started = True
+                if data:
+                    emit({'type': 'http.response.body', 'body': data, 'more_body': True})
+            if not started:
+                emit(start)
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    # The views, async versions of the ones of app/api.py
+
+    async def get_user(self, connection, user, username):
+        row = (await connection.execute(user_select(username))).first()
+        if row is None:
+            abort(404)
+        return jsonify(user_json(row, last_seen.last_seen(row)))
+
+    async def get_user_posts(self, connection, user, username):
+        user_id = (await connection.execute(
+            db.select(User.id).where(User.username == username))).scalar()
+        if user_id is None:
+            abort(404)
+
+        async def fetch(connection, before, limit):
+            return split_page((await connection.execute(
+                posts_select(user_id, before, limit + 1))).all(), limit)
+        return await self.posts_response(connection, fetch, 'api.get_user_posts',
+                                         username=username)
+
+    async def get_timeline(self, connection, user):
+        async def fetch(connection, before, limit):
+            keys = await timeline_keys(connection, user.id, before, limit + 1)
+            next_cursor = keys[limit - 1] if len(keys) > limit else None
+            keys = keys[:limit]
+            rows = (await connection.execute(
+                posts_by_id_select([id for _, id in keys]))).all()
+            return in_key_order(keys, rows), next_cursor
+        return await self.posts_response(connection, fetch, 'api.get_timeline')
+
+    async def posts_response(self, connection, fetch, endpoint, **values):
+        """Page of posts, or an async generator of all of them as NDJSON"""
+        before = request_cursor()
+        if wants_ndjson():
+            return self.stream(fetch, before)
+        limit = request_limit()
+        rows, next_cursor = await fetch(connection, before, limit)
+        return jsonify(page_json(rows, next_cursor, limit, endpoint, **values))
+
+    async def stream(self, fetch, cursor):
+        chunk = self.app.config['API_STREAM_CHUNK']
+        while True:
+            # A connection per chunk, none stays checked out while the client
+            # reads
+            async with self.engine.connect() as connection:
+                rows, cursor = await fetch(connection, cursor, chunk)
+            yield ndjson_lines(rows).encode('utf-8')
+            if cursor is None:
+                return
@@ -0,0 +1,7 @@
+"""Login, logout and registration of the users"""
+from flask import Blueprint
+
+bp = Blueprint('auth', __name__)
+
+# Imported at the bottom, routes uses bp
+from app.auth import routes
@@ -0,0 +1,84 @@
+"""Module to store the web form classes of the auth blueprint.
+    All imports necessary to work with web forms
+    I'll need to import this classes from routes.py
+    """
+# To work with forms
+from flask_wtf import FlaskForm
+# Import the classes to create the objects in the form
+from wtforms import StringField, PasswordField, BooleanField, SubmitField
+# Import this to attach validation to the fields
+from wtforms.validators import DataRequired, Email, EqualTo
+# Import User to implement user registration
+from app.models import User
+# To check the username and the email in one query
+from sqlalchemy import or_
+
+
+class LoginForm(FlaskForm):
+    """LoginForm class to represent the Login form of our app
+        We create the objects from the classes representing the 
+        fields in this form.
+        validators are used to check if the field data is correct. If not, 
+        returns an error inside form.<field>.errors and we can show them
+        in the html file
+
+    Args:
+        FlaskForm (class): Base class to work with forms
+    """
+    username = StringField('Username', validators=[DataRequired()])
+    password = PasswordField('Password', validators=[DataRequired()])
+    remember_me = BooleanField('Remember Me')
+    submit = SubmitField('Sign In')
+
+class RegistrationForm(FlaskForm):
+    """Class to implement the Registration form of our application.
+
+    validate() also checks that the username and the email are not in the db.
+
+    Args:
+        FlaskForm (class): Base class to work with forms
+    """
+    username = StringField('Username', validators=[DataRequired()])
+    email = StringField('Email', validators=[DataRequired(), Email()])
+    password = PasswordField('Password', validators=[DataRequired()])
+    password2 = PasswordField(
+        'Repeat Password', validators=[DataRequired(), EqualTo('password')])
+    submit = SubmitField('Register')
+    
+    # The username and the email are checked together with a single query,
+    # once the stock validators passed. It's a friendly early answer only: two
+    # registrations can still pass it at the same time, the unique indexes
+    # of the user table decide and unique_violation() reports the loser.
+    def validate(self, **kwargs):
+        # An invalid submission costs no query
+        if not super().validate(**kwargs):
+            return False
+        taken = User.query.with_entities(User.username, User.email).filter(
+            or_(User.username == self.username.data,
+                User.email == self.email.data)).all()
+        for username, email in taken:
+            if username == self.username.data:
+                self.username.errors.append('Please use a different username.')
+            if email == self.email.data:
+                self.email.errors.append('Please use a different email address.')
+        return not taken
+
+    def unique_violation(self, error):
+        """Turn the IntegrityError of a duplicate user into form errors
+
+        Args:
+            error (IntegrityError): raised by the commit of the new user
+
+        Returns:
+            bool: True if the error was a duplicate username or email
+        """
+        # SQLite says "UNIQUE constraint failed: user.username", other
+        # databases give the name of the index, ix_user_username
+        message = str(error.orig)
+        if 'username' in message:
+            self.username.errors.append('Please use a different username.')
+        elif 'email' in message:
+            self.email.errors.append('Please use a different email address.')
+        else:
+            return False
+        return True
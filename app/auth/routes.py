@@ -0,0 +1,105 @@
+"""Routes of the auth blueprint: login, logout and registration
+Returns:
+"""
+from flask import render_template, flash, redirect, url_for, request
+# We have to import current_user and login_user from flask-login
+# logout_user to log out of the application
+from flask_login import current_user, login_user, logout_user
+from werkzeug.urls import url_parse
+# Raised by the commit when a unique index rejects a row
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.auth import bp
+#Import the classes from the forms module
+from app.auth.forms import LoginForm, RegistrationForm
+# Import the class User from app/models.py
+from app.models import User
+
+# methods tells Flask that this view function accepts GET and POST requests
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    """Before we can see the login form we need to codify the route
+    and the function attached to it
+
+    Returns:
+        _type_: we return redirect or render_template
+    """
+    # We use the current_user imported before and one of those required properties
+    # for flask-login implemented with UserMixin
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    #Create an object form from the class LoginFrom
+    form = LoginForm()
+    # This method does all the form processing work.
+    # Returns False if the browser sends the GET request to receive
+    # the web page with the form.
+    # If the browser send the POST request (press submit button), form.validate_on_submit
+    # will gather all the data, run the validators attached to the fields and
+    # if everything is ok return True. If this happens we call flash() function,
+    # imported to show message to the user; and redirect(),
+    # which instructs the client web browser to navigate to a different page.
+    if form.validate_on_submit():
+        # Return the first element of the search. Will only be 0 or 1
+        user = User.query.filter_by(username=form.username.data).first()
+        if user is None or not user.check_password(form.password.data):
+            # when we call flash, Flask stores the message, but we need to add functionality
+            # in base.html to see these messages
+            flash('Invalid username or password')
+            return redirect(url_for('auth.login'))
+        # We have the password in clear only now, it's the moment to bring
+        # an old hash up to the configured method and work factor
+        if user.password_needs_rehash():
+            user.set_password(form.password.data)
+            db.session.commit()
+        # If login and pass are correct then I call login_user function
+        # coming from Flask-Login. This function register the user as logged in,
+        # so any future pages the user navigate to will have the current_user
+        # variable set to that user.
+        login_user(user, remember=form.remember_me.data)
+        """in a friendly dictionary format. Three cases.
+        The request.args attribute exposes the contents of the query string
+        Login URL doesn't have next argument -> user redirected to index page
+        Login URL includes next arg. that is set to a relative path (URL
+        without the domain portion), the users is redirected to that URL
+        Login URL includes a next argument set to a full URL that includes a 
+        domain name, the user is redirected to the index page."""
+        next_page = request.args.get('next')
+        # werkzeug url_parse function to check if url is relative or absolute.
+        # and check if the netloc comp is true or false
+        if not next_page or url_parse(next_page).netloc != '':
+            next_page = url_for('main.index')
+        #The message is created but not showed. We need to add code in base.html
+        # flash(
+        #     f'Login requested for user {form.username.data}, remember_me={form.remember_me.data}')
+        return redirect(next_page)
+    """We can see login.html and we send arguments to it, title will be in base.html
+    and form will be in login.html. We pass form object to the variable form"""
+    return render_template('auth/login.html', title='Sign In', form=form)
+
+# This option is for the user to log out
+@bp.route('/logout')
+def logout():
+    logout_user()
+    return redirect(url_for('main.index'))
+
+# New user registration form
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    form = RegistrationForm()
+    if form.validate_on_submit():
+        user = User(username=form.username.data, email=form.email.data)
+        user.set_password(form.password.data)
+        db.session.add(user)
+        try:
+            db.session.commit()
+        except IntegrityError as error:
+            # Someone registered the same username or email after the check
+            db.session.rollback()
+            if not form.unique_violation(error):
+                raise
+        else:
+            flash('Congratulations, you are now a registered user!')
+            return redirect(url_for('auth.login'))
+    return render_template('auth/register.html', title='Register', form=form)
@@ -0,0 +1,265 @@
+"""Custom flask commands
+  Commands registered here run with the application configured, like the
+  built-in ones: flask <command>. The blueprint has no command group of its
+  own (cli_group=None), the commands sit next to the built-in ones.
+"""
+import itertools
+import os
+import random
+import re
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import event, func, text
+from flask import Blueprint, current_app
+from werkzeug.security import generate_password_hash
+from app import db, search, metrics, template_cache
+from app.models import User, Post, TimelineEntry, followers, email_digest, \
+    post_authors_select
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+def explain(function):
+    """Run a function and return the query plan of every SELECT it executed
+
+    Args:
+        function (callable): runs the queries to check
+
+    Returns:
+        list: (statement, plan lines) tuples
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        function()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    plans = []
+    for statement, parameters in statements:
+        if statement.lstrip().upper().startswith('SELECT'):
+            rows = db.session.connection().exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            plans.append((statement, [row[-1] for row in rows]))
+    return plans
+
+# Plan lines showing that SQLite reads a whole table or sorts the rows itself
+BAD_PLAN = re.compile(r'^SCAN (post|timeline_entry|user)\b|TEMP B-TREE')
+
+
+@bp.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if the profile or timeline queries stop using an index (SQLite)."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('EXPLAIN QUERY PLAN needs a SQLite database')
+    # Any user works, SQLite plans the same queries whatever the values are.
+    # In an empty database a temporary one is created and rolled back at the end
+    user = User.query.first()
+    if user is None:
+        user = User(username='query-plan-check')
+        db.session.add(user)
+        db.session.flush()
+    per_page = current_app.config['POSTS_PER_PAGE']
+    checks = {
+        'profile': lambda: (
+            User.query.filter_by(username=user.username).first(),
+            user.posts_page(None, per_page)),
+        'profile next page': lambda: user.posts_page(
+            (datetime.utcnow(), 2 ** 31), per_page),
+        'timeline': lambda: user.timeline(None, per_page),
+        # The ETag of the home page, checked before the posts are loaded
+        'timeline validators': lambda: db.session.execute(
+            post_authors_select(list(range(1, per_page + 1)))).all(),
+    }
+    failed = False
+    for name, function in checks.items():
+        for statement, plan in explain(function):
+            bad = [line for line in plan if BAD_PLAN.search(line)]
+            click.echo('{} {}: {}'.format('FAIL' if bad else 'ok', name,
+                                          ' '.join(statement.split())[:100]))
+            for line in plan:
+                click.echo('    ' + line)
+            failed = failed or bool(bad)
+    db.session.rollback()
+    if failed:
+        raise click.ClickException('some queries are not using an index')
+
+
+# Words for the generated posts
+WORDS = ('the a my our this that day night time people work home city music '
+         'coffee code python flask database index query cache page post user '
+         'today tomorrow yesterday great slow fast new old love hate think '
+         'portland weather movie book game team friend family food trip run '
+         'happy tired busy finally again never always really just').split()
+
+
+def _batches(count, size):
+    # (start, length) of each batch
+    for start in range(0, count, size):
+        yield start, min(size, count - start)
+
+
+@bp.cli.command('seed')
+@click.option('--users', default=10000, help='Number of users to create.')
+@click.option('--posts', default=100000, help='Number of posts to create.')
+@click.option('--follows', default=20, help='Average number of users each user follows.')
+@click.option('--days', default=365, help='Posts are spread over this many past days.')
+@click.option('--batch', default=10000, help='Rows per INSERT and per transaction.')
+@click.option('--seed', 'random_seed', default=42, help='Random seed, same seed same data.')
+def seed(users, posts, follows, days, batch, random_seed):
+    """Bulk-generate users, follows and posts for performance testing.
+
+    Rows are written with executemany INSERTs of --batch rows per transaction,
+    without ORM objects. The number of followers and the number of posts of
+    the users follow heavy-tailed (Pareto) distributions. Post timestamps
+    grow denser towards today and follow a daily cycle. All the users have
+    the password "password".
+    """
+    rng = random.Random(random_seed)
+    user_table, post_table = User.__table__, Post.__table__
+    # New rows go after the existing ones, the ids are known in advance
+    first_user = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    first_post = (db.session.query(func.max(Post.id)).scalar() or 0) + 1
+    user_ids = range(first_user, first_user + users)
+    # Hashing is slow on purpose, every generated user shares the same hash
+    password_hash = generate_password_hash(
+        'password', method=current_app.config['PASSWORD_HASH_METHOD'],
+        salt_length=current_app.config['PASSWORD_SALT_LENGTH'])
+    now = datetime.utcnow()
+
+    for start, length in _batches(users, batch):
+        rows = []
+        for id in user_ids[start:start + length]:
+            email = 'user{}@example.com'.format(id)
+            rows.append({
+                'id': id, 'username': 'user{}'.format(id), 'email': email,
+                'email_hash': email_digest(email), 'password_hash': password_hash,
+                'about_me': ' '.join(rng.choices(WORDS, k=rng.randint(0, 12))),
+                'last_seen': now - timedelta(seconds=rng.expovariate(1 / 86400.0)),
+                'follower_count': 0, 'profile_version': 1})
+        db.session.execute(user_table.insert(), rows)
+        db.session.commit()
+    click.echo('{} users'.format(users))
+
+    # A few users are very popular, most are not. Cumulative weights are
+    # computed once, choices() would redo it on every call
+    popularity = list(itertools.accumulate(rng.paretovariate(1.2) for _ in user_ids))
+    pairs = 0
+    for start, length in _batches(users, max(1, batch // max(follows, 1))):
+        rows = []
+        for follower in user_ids[start:start + length]:
+            count = min(users - 1, int(rng.expovariate(1.0 / follows)))
+            followed = set(rng.choices(user_ids, cum_weights=popularity, k=count))
+            followed.discard(follower)
+            rows += [{'follower_id': follower, 'followed_id': id} for id in followed]
+        if rows:
+            db.session.execute(followers.insert(), rows)
+            db.session.commit()
+            pairs += len(rows)
+    db.session.execute(user_table.update().where(
+        user_table.c.id >= first_user).values(follower_count=db.select(
+            func.count()).where(followers.c.followed_id == user_table.c.id)
+        .scalar_subquery()))
+    db.session.commit()
+    click.echo('{} follows'.format(pairs))
+
+    # Posts are generated from the oldest to the newest so the ids grow with
+    # the timestamps, as they do in a real database. Batch k covers the slice
+    # k of [0, 1) and sqrt() makes recent days busier than old ones
+    span = timedelta(days=days).total_seconds()
+    # Activity is heavy-tailed too, and independent of popularity
+    activity = list(itertools.accumulate(rng.paretovariate(1.2) for _ in user_ids))
+    for start, length in _batches(posts, batch):
+        authors = rng.choices(user_ids, cum_weights=activity, k=length)
+        moments = sorted(rng.uniform(start, start + length) / posts for _ in range(length))
+        rows = []
+        for offset, (author, moment) in enumerate(zip(authors, moments)):
+            day = now - timedelta(seconds=span * (1 - moment ** 0.5))
+            # Most posts are written in the evening
+            second = int(rng.gauss(20 * 3600, 4 * 3600)) % 86400
+            timestamp = min(now, day.replace(hour=0, minute=0, second=0) +
+                            timedelta(seconds=second, microseconds=rng.randrange(10 ** 6)))
+            rows.append({
+                'id': first_post + start + offset, 'user_id': author, 'timestamp': timestamp,
+                'body': ' '.join(rng.choices(WORDS, k=rng.randint(3, 20)))[:140]})
+        db.session.execute(post_table.insert(), rows)
+        db.session.commit()
+    click.echo('{} posts'.format(posts))
+
+    # The bulk inserts skipped the Post events: fan out the new posts to the
+    # timelines and update the search index here
+    entries = TimelineEntry.__table__
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+    for start, length in _batches(posts, batch):
+        ids = (post_table.c.id >= first_post + start) & \
+            (post_table.c.id < first_post + start + length)
+        columns = ['user_id', 'timestamp', 'post_id']
+        db.session.execute(entries.insert().from_select(columns, db.select(
+            post_table.c.user_id, post_table.c.timestamp, post_table.c.id).where(ids)))
+        db.session.execute(entries.insert().from_select(columns, db.select(
+            followers.c.follower_id, post_table.c.timestamp, post_table.c.id)
+            .select_from(post_table.join(
+                followers, followers.c.followed_id == post_table.c.user_id)
+                .join(user_table, user_table.c.id == post_table.c.user_id))
+            .where(ids).where(user_table.c.follower_count <= limit)))
+        db.session.commit()
+    click.echo('timelines filled')
+    if search.enabled:
+        search.backend.rebuild()
+        click.echo('search index rebuilt')
+
+
+@bp.cli.command('compile-templates')
+@click.option('--clear', is_flag=True, help='Delete the compiled templates first.')
+def compile_templates(clear):
+    """Compile all the templates into TEMPLATE_CACHE_DIR.
+
+    Run at deploy time, from the directory the application runs in (the
+    entries are keyed by the template paths): the new worker processes then
+    serve their first pages without compiling any template. Exits with an
+    error when a template doesn't compile.
+    """
+    app = current_app._get_current_object()
+    cache = app.jinja_env.bytecode_cache
+    if cache is None:
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not set')
+    if clear:
+        cache.clear()
+    loaded, errors = template_cache.compile_all(app)
+    for name, error in errors:
+        click.echo('{}: {}'.format(name, error), err=True)
+    click.echo('{} templates compiled in {}'.format(loaded, cache.directory))
+    if errors:
+        raise click.ClickException('{} templates failed to compile'.format(len(errors)))
+
+
+@bp.cli.command('serve')
+@click.option('--host', default='127.0.0.1', help='Address to listen on.')
+@click.option('--port', default=8000, help='Port to listen on.')
+@click.option('--workers', default=os.cpu_count() or 1, help='Worker processes, one per core by default.')
+@click.option('--max-requests', default=10000, help='Requests before a worker is replaced, 0 for never.')
+@click.option('--max-requests-jitter', default=1000, help='Random extra requests per worker.')
+@click.option('--max-memory', default=512, help='Resident memory (MB) before a worker is replaced, 0 for no limit.')
+@click.option('--timeout', default=30, help='Seconds the workers get to finish on shutdown.')
+@click.option('--access-log', is_flag=True, help='Log a line per request.')
+def serve(host, port, workers, max_requests, max_requests_jitter, max_memory, timeout,
+          access_log):
+    """Production server: pre-forked worker processes.
+
+    The application and its templates are loaded once and shared by the
+    workers, which are replaced after --max-requests requests or
+    --max-memory MB. /server-status shows the counters of every worker.
+    """
+    # Imported here, fork() is POSIX only and the other commands don't need it
+    from app.prefork import PreforkServer
+    server = PreforkServer(current_app._get_current_object(), host, port, workers,
+                           max_requests, max_requests_jitter, max_memory * 1024 * 1024,
+                           timeout, access_log)
+    # The totals of all the workers are in /metrics too
+    metrics.register('workers', server.stats.stats,
+                     counters=('requests', 'errors', 'latency_seconds', 'restarts'))
+    click.echo('Serving on http://{}:{} with {} workers'.format(host, port, workers))
+    server.serve()
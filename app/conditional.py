@@ -0,0 +1,53 @@
+"""Conditional GET
+  Browsers and proxies that already have a page send back the ETag we gave
+  them in If-None-Match. When the ETag computed for the request is the same,
+  the view answers 304 Not Modified without loading the posts or rendering
+  the template.
+  ETags are built from cheap values (ids, versions and the newest post)
+  that change whenever the page would change, including the profiles of the
+  authors shown on it. The pages send no Last-Modified: the date of their
+  newest post misses the profile edits, so If-Modified-Since is not
+  answered.
+"""
+from hashlib import sha1
+from time import time
+from flask import current_app, make_response, request, session
+
+
+def etag_for(*parts):
+    """Build an ETag from the values the page depends on"""
+    return sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def form_epoch():
+    """Changes twice in the lifetime of a CSRF token. Pages with forms add it
+    to their validators so a cached copy never carries an expired token"""
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    return int(time() // (limit / 2)) if limit else 0
+
+
+def not_modified(etag):
+    """Return a 304 response when the client copy is still good
+
+    Args:
+        etag (str): ETag of the current version of the page
+
+    Returns:
+        Response: 304 response, or None when the page must be rendered
+    """
+    # The page would show one-time flashed messages
+    if '_flashes' in session:
+        return None
+    if not request.if_none_match or not request.if_none_match.contains_weak(etag):
+        return None
+    return add_validators(make_response('', 304), etag)
+
+
+def add_validators(response, etag):
+    """Add the ETag to a response, clients revalidate on every use"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    # The page depends on the logged in user
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,182 @@
+"""Database engine tuning
+  SQLite in its default rollback journal mode locks the whole file while a
+  transaction writes, so every page view waits behind the commits of the
+  other requests (last_seen, new posts). In WAL mode readers don't block
+  writers and writers don't block readers. The pragmas are set on every new
+  connection:
+    journal_mode  WAL, stored in the database file (not for network filesystems)
+    synchronous   NORMAL is safe with WAL and avoids an fsync per commit
+    busy_timeout  milliseconds a writer waits for the lock instead of failing
+    mmap_size     bytes of the file read through memory mapping
+  Flask-SQLAlchemy opens a new SQLite connection for every checkout unless a
+  pool size is set, the connections are pooled here so the pragmas run once
+  per connection.
+  Server databases (PostgreSQL, MySQL) get a pool of DATABASE_POOL_SIZE
+  connections, pre-ping to replace the connections the server closed and a
+  recycle age.
+  The ASGI mode (app/asgi.py) opens the same database with an asyncio
+  driver, async_url() picks it and the pool and pragmas are the same.
+  Flask-Migrate is set up with LazyMigrate: Alembic is only imported by the
+  flask db commands, the web processes never load it.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+SQLITE_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SQLITE_SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+# asyncio driver of each backend
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg', 'mysql': 'aiomysql'}
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(uri, config):
+    """Arguments of create_engine() for a database
+
+    Args:
+        uri (str): URL of the database
+        config (dict): application configuration with the DATABASE_POOL_* values
+
+    Returns:
+        dict: options for SQLALCHEMY_ENGINE_OPTIONS
+    """
+    backend = make_url(uri).get_backend_name()
+    if backend == 'sqlite':
+        # Flask-SQLAlchemy already uses a single shared connection for
+        # in-memory databases
+        if not is_sqlite_file(uri):
+            return {}
+        # SQLAlchemy defaults to no pool for SQLite files. Each connection is
+        # used by one thread at a time, the pool makes sure of that
+        return {'poolclass': QueuePool, 'pool_size': config['DATABASE_POOL_SIZE'],
+                'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+                'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+                'connect_args': {'check_same_thread': False}}
+    return {'pool_size': config['DATABASE_POOL_SIZE'],
+            'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+            'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+            'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+            'pool_pre_ping': config['DATABASE_POOL_PRE_PING']}
+
+
+def async_url(uri):
+    """URL of the same database with the asyncio driver of its backend
+
+    Args:
+        uri (str): URL of the database, like sqlite:///app.db
+
+    Raises:
+        ValueError: no asyncio driver is known for the backend
+
+    Returns:
+        URL: the URL for create_async_engine(), like sqlite+aiosqlite:///app.db
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError('No asyncio driver for {}, set ASYNC_DATABASE_URL'.format(backend))
+    return url.set(drivername='{}+{}'.format(backend, ASYNC_DRIVERS[backend]))
+
+
+def async_engine_options(uri, config):
+    """engine_options() for create_async_engine()"""
+    options = engine_options(uri, config)
+    # The pool of an async engine must be the asyncio-aware version
+    if options.get('poolclass') is QueuePool:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    return options
+
+
+def sqlite_pragmas(config):
+    """PRAGMA statements to run on each new SQLite connection
+
+    Args:
+        config (dict): application configuration with the SQLITE_* values
+
+    Returns:
+        list: the statements
+    """
+    journal_mode = config['SQLITE_JOURNAL_MODE'].upper()
+    synchronous = config['SQLITE_SYNCHRONOUS'].upper()
+    # The values are put in the SQL text, only known words are accepted
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError('Unknown SQLITE_JOURNAL_MODE {!r}'.format(journal_mode))
+    if synchronous not in SQLITE_SYNCHRONOUS:
+        raise ValueError('Unknown SQLITE_SYNCHRONOUS {!r}'.format(synchronous))
+    return ['PRAGMA journal_mode={}'.format(journal_mode),
+            'PRAGMA synchronous={}'.format(synchronous),
+            'PRAGMA busy_timeout={:d}'.format(int(config['SQLITE_BUSY_TIMEOUT'])),
+            'PRAGMA mmap_size={:d}'.format(int(config['SQLITE_MMAP_SIZE']))]
+
+
+def tune_engine(engine, config):
+    """Run the SQLite pragmas on every connection the engine opens
+
+    Args:
+        engine (Engine): engine of a database, other backends are left alone
+        config (dict): application configuration
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    event.listen(engine, 'connect', set_pragmas)
+
+
+def init_engine(app):
+    """Set the engine options of the application database. The engine itself
+    is created on first use and tuned by RoutingSQLAlchemy.create_engine()
+
+    Args:
+        app (Flask): the application, SQLALCHEMY_ENGINE_OPTIONS set in the
+            configuration are kept as they are
+    """
+    if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+            app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+
+
+class LazyMigrate(object):
+    """Stands for Flask-Migrate in app.extensions['migrate'] and sets it up
+    the first time a flask db command (or migrations/env.py) reads it
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+        db (SQLAlchemy, optional): database of the application
+        kwargs: arguments of Migrate, like include_object
+    """
+
+    def __init__(self, app=None, db=None, **kwargs):
+        self.kwargs = kwargs
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.extensions['migrate'] = _PendingMigrate(app, db, self.kwargs)
+
+
+class _PendingMigrate(object):
+
+    def __init__(self, app, db, kwargs):
+        self.app = app
+        self.db = db
+        self.kwargs = kwargs
+
+    def __getattr__(self, name):
+        # Only called for the attributes this object doesn't have: the ones
+        # of the configuration Migrate.init_app() puts in its place
+        from flask_migrate import Migrate
+        Migrate(self.app, self.db, **self.kwargs)
+        return getattr(self.app.extensions['migrate'], name)
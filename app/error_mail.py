@@ -0,0 +1,209 @@
+"""Error emails
+  Sending the email inside the failing request means that during an incident
+  every 500 also waits for an SMTP round trip. Here the request only puts the
+  log record in a bounded queue (QueueHandler) and a background thread
+  (QueueListener) sends the emails.
+  The thread also coalesces identical errors: the first one is sent at once,
+  the repeats within MAIL_COALESCE_WINDOW seconds are counted and sent as one
+  summary email at the end of the window. When the queue is full, records are
+  dropped and counted instead of blocking the request. The thread is started
+  by the first error, in the process that logs it. Each application has its
+  own queue and thread, kept in app.extensions.
+
+  To try it with a local SMTP server that prints the emails:
+  $ python -m aiosmtpd -n -l localhost:8025
+  $ export MAIL_SERVER=localhost MAIL_PORT=8025
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import traceback
+from hashlib import sha1
+from logging.handlers import QueueHandler, QueueListener, SMTPHandler
+from time import monotonic
+from flask import current_app
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: it drops the record when the queue is full"""
+
+    def __init__(self, queue, listener=None):
+        super().__init__(queue)
+        self.listener = listener
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Identical tracebacks get the same fingerprint. Computed here because
+        # prepare() turns the exception into text
+        if record.exc_info:
+            text = "".join(traceback.format_exception(*record.exc_info))
+        else:
+            text = "{}:{}:{}".format(record.pathname, record.lineno, record.msg)
+        fingerprint = sha1(text.encode("utf-8")).hexdigest()
+        record = super().prepare(record)
+        record.fingerprint = fingerprint
+        return record
+
+    def enqueue(self, record):
+        if self.listener is not None:
+            self.listener.ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class CoalescingHandler(logging.Handler):
+    """Sends the first of a series of identical records and a summary of the
+    repeats once the window is over
+
+    Args:
+        target (Handler): handler that sends the emails
+        window (float): seconds during which identical records are coalesced
+    """
+
+    def __init__(self, target, window):
+        super().__init__()
+        self.target = target
+        self.window = window
+        # fingerprint -> [end of the window, repeats, first record]
+        self._series = {}
+        self.sent = 0
+        self.coalesced = 0
+
+    def emit(self, record):
+        self.tick()
+        series = self._series.get(record.fingerprint)
+        if series is not None:
+            series[1] += 1
+            self.coalesced += 1
+            return
+        self._series[record.fingerprint] = [monotonic() + self.window, 0, record]
+        self._send(record)
+
+    def tick(self, force=False):
+        """Close the windows that are over and send their summaries"""
+        now = monotonic()
+        for fingerprint, (end, repeats, first) in list(self._series.items()):
+            if force or end <= now:
+                del self._series[fingerprint]
+                if repeats:
+                    self._send(logging.makeLogRecord({
+                        "name": first.name, "levelno": first.levelno,
+                        "levelname": first.levelname,
+                        "msg": "The following error happened {} more times in "
+                               "{:.0f} seconds:\n\n{}".format(
+                                   repeats, self.window, first.getMessage())}))
+
+    def _send(self, record):
+        self.sent += 1
+        self.target.handle(record)
+
+    def close(self):
+        self.tick(force=True)
+        self.target.close()
+        super().close()
+
+
+class ErrorMailListener(QueueListener):
+    """QueueListener that wakes up regularly to close the coalescing windows"""
+
+    def __init__(self, queue, handler, tick=1.0):
+        super().__init__(queue, handler)
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        """Start the thread if it isn't running in this process: on the first
+        record, and again in a process forked from this one"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = None
+                self.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._pid == os.getpid()
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(timeout=self.tick)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.tick()
+
+    def enqueue_sentinel(self):
+        # The queue can be full, wait for room instead of dropping the sentinel
+        self.queue.put(self._sentinel)
+
+
+class ErrorMail(object):
+    """Sends the ERROR records of app.logger by email, from a background thread
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.debug or not app.config['MAIL_SERVER']:
+            return
+        auth = None
+        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
+            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+        secure = None
+        if app.config['MAIL_USE_TLS']:
+            secure = ()
+        mail_handler = SMTPHandler(
+            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
+            fromaddr='no-reply@' + app.config['MAIL_SERVER'],
+            toaddrs=app.config['ADMINS'], subject='Microblog Failure',
+            credentials=auth, secure=secure)
+        handler = CoalescingHandler(mail_handler, app.config['MAIL_COALESCE_WINDOW'])
+        records = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        listener = ErrorMailListener(records, handler)
+        queue_handler = BoundedQueueHandler(records, listener)
+        queue_handler.setLevel(logging.ERROR)
+        app.logger.addHandler(queue_handler)
+        app.extensions['error_mail'] = queue_handler
+        # Send what is still in the queue and the pending summaries on exit
+        atexit.register(self._stop, listener)
+
+    @staticmethod
+    def _stop(listener):
+        if listener.running:
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+
+    def stop(self):
+        """Send the queued records of the current application and stop its
+        thread"""
+        queue_handler = current_app.extensions.get('error_mail')
+        if queue_handler is not None:
+            self._stop(queue_handler.listener)
+
+    def stats(self):
+        """Counters of the error mail pipeline, for monitoring
+
+        Returns:
+            dict: sent, coalesced and dropped records, queued records
+        """
+        queue_handler = current_app.extensions.get('error_mail')
+        if queue_handler is None:
+            return {}
+        listener = queue_handler.listener
+        handler = listener.handlers[0]
+        return {'sent': handler.sent, 'coalesced': handler.coalesced,
+                'dropped': queue_handler.dropped,
+                'queued': listener.queue.qsize()}
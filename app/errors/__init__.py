@@ -0,0 +1,7 @@
+"""Error pages"""
+from flask import Blueprint
+
+bp = Blueprint('errors', __name__)
+
+# Imported at the bottom, handlers uses bp
+from app.errors import handlers
@@ -0,0 +1,28 @@
+"""handlers.py
+  This module is to put all the error handlers together
+
+Returns:
+  html: custom error page
+"""
+
+from flask import render_template
+from app import db
+from app.errors import bp
+
+# This decorator is used to declare a custom error handler. app_errorhandler
+# handles the errors of the whole application, not only of this blueprint
+@bp.app_errorhandler(404)
+def not_found_error(error):
+  # Return the template and the error code number. In the view functions I don't need to 
+  return render_template('404.html'), 404
+
+# Too many login or registration attempts, see app/rate_limit.py. Retry-After
+# tells the client when it can try again
+@bp.app_errorhandler(429)
+def too_many_requests(error):
+  return render_template('429.html'), 429, {'Retry-After': str(error.retry_after)}
+
+@bp.app_errorhandler(500)
+def internal_error(error):
+  db.session.rollback()
+  return render_template('500.html'), 500
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""Rendered fragment cache
+  A post looks the same every time it's shown, until its author changes the
+  profile (username or avatar). The HTML of _post.html is kept in memory keyed
+  by (post id, author profile version, avatar size), so the timeline pages
+  mostly join strings that were rendered before instead of running Jinja for
+  every post.
+  The cache is an LRU bounded by the total size of the stored fragments,
+  FRAGMENT_CACHE_MAX_BYTES, counted in UTF-8 bytes. Each application has its
+  own cache, kept in app.extensions.
+"""
+import threading
+from collections import OrderedDict
+from flask import current_app, render_template
+from markupsafe import Markup
+
+
+class Fragments(object):
+    """LRU of the rendered posts of one application
+
+    Args:
+        max_bytes (int): total size of the fragments kept
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (author id, html), most recently used at the end
+        self._fragments = OrderedDict()
+        # author id -> keys of the posts of that author in the cache
+        self._by_author = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render_post(self, post, avatar_size=36):
+        """HTML of a post, rendered with _post.html on a miss
+
+        Args:
+            post (Post): the post to show
+            avatar_size (int, optional): pixels of the avatar. Defaults to 36
+
+        Returns:
+            Markup: the fragment, safe to include in a template
+        """
+        author = post.author
+        key = (post.id, author.profile_version, avatar_size)
+        with self._lock:
+            entry = self._fragments.get(key)
+            if entry is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return Markup(entry[1])
+        self.misses += 1
+        html = render_template('_post.html', post=post, avatar_size=avatar_size)
+        self._store(key, author.id, html)
+        return Markup(html)
+
+    def _store(self, key, author_id, html):
+        with self._lock:
+            if key in self._fragments:
+                return
+            # Bytes, a character of a username or post can take up to four
+            size = len(html.encode('utf-8'))
+            self._fragments[key] = (author_id, html, size)
+            self._by_author.setdefault(author_id, set()).add(key)
+            self.size += size
+            while self.size > self.max_bytes and self._fragments:
+                old_key, (old_author_id, _, old_size) = self._fragments.popitem(last=False)
+                self.size -= old_size
+                keys = self._by_author[old_author_id]
+                keys.discard(old_key)
+                if not keys:
+                    del self._by_author[old_author_id]
+                self.evictions += 1
+
+    def invalidate_author(self, author_id):
+        with self._lock:
+            for key in self._by_author.pop(author_id, ()):
+                entry = self._fragments.pop(key, None)
+                if entry is not None:
+                    self.size -= entry[2]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self._fragments),
+                'size': self.size}
+
+
+class FragmentCache(object):
+    """LRU cache of rendered posts, available in the templates as render_post()
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        fragments = app.extensions['fragments'] = Fragments(
+            app.config['FRAGMENT_CACHE_MAX_BYTES'])
+        app.add_template_global(fragments.render_post, 'render_post')
+
+    def invalidate_author(self, author_id):
+        """Drop the posts of an author, after a change of its profile_version"""
+        current_app.extensions['fragments'].invalidate_author(author_id)
+
+    def stats(self):
+        """Counters of the cache of the current application, for monitoring
+
+        Returns:
+            dict: hits, misses, evictions, entries and size in bytes
+        """
+        return current_app.extensions['fragments'].stats()
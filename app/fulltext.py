@@ -0,0 +1,170 @@
+"""Full-text search of posts
+  Searching with LIKE '%word%' reads every post. Search engines keep an
+  inverted index instead (word -> posts containing it), so a query only reads
+  the entries of its words.
+  The index lives behind a small backend interface. The default backend uses
+  the FTS5 extension of SQLite, other engines can be added with
+  register_backend() and selected with SEARCH_BACKEND. The index is updated in
+  the same transaction as the post table, when a post is inserted, changed or
+  deleted.
+  The FTS5 table is created with the post table, by the migration or by
+  db.create_all() (post_fts_ddl()), a schema built from the models is
+  complete.
+  The backend is selected for each application and kept in app.extensions.
+"""
+from flask import current_app
+from sqlalchemy import DDL, event, text
+
+
+class SearchBackend(object):
+    """Interface of the search backends
+
+    Args:
+        db (SQLAlchemy): database of the application
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def add(self, connection, id, body):
+        """Index a new post, inside the transaction that inserts it"""
+        raise NotImplementedError
+
+    def remove(self, connection, id, body):
+        """Remove a post from the index, body is the indexed text"""
+        raise NotImplementedError
+
+    def search(self, query, page, per_page):
+        """Run a query
+
+        Args:
+            query (str): words typed by the user
+            page (int): page number, starting at 1
+            per_page (int): results per page
+
+        Returns:
+            tuple: (post ids ordered by relevance, total number of results)
+        """
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Index all the posts again, after rows were loaded without the ORM"""
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """SQLite FTS5 index in the post_fts virtual table
+
+    post_fts is an external content table: it only stores the index and reads
+    the text from post.body, so the posts are not stored twice.
+    """
+
+    @staticmethod
+    def _match(query):
+        # Every word in double quotes, words are ANDed and characters with a
+        # meaning in the FTS5 syntax ("*", "-", "NEAR"...) are plain text
+        return " ".join('"{}"'.format(word.replace('"', '""'))
+                        for word in query.split())
+
+    def add(self, connection, id, body):
+        connection.execute(text(
+            "INSERT INTO post_fts (rowid, body) VALUES (:id, :body)"),
+            {"id": id, "body": body or ""})
+
+    def remove(self, connection, id, body):
+        # External content tables need the old text to remove its words
+        connection.execute(text(
+            "INSERT INTO post_fts (post_fts, rowid, body) "
+            "VALUES ('delete', :id, :body)"), {"id": id, "body": body or ""})
+
+    def search(self, query, page, per_page):
+        match = self._match(query)
+        if not match:
+            return [], 0
+        # rank is the bm25 relevance computed by FTS5, best results first
+        ids = self.db.session.execute(text(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH :match "
+            "ORDER BY rank LIMIT :limit OFFSET :offset"),
+            {"match": match, "limit": per_page,
+             "offset": (page - 1) * per_page}).scalars().all()
+        total = self.db.session.execute(text(
+            "SELECT count(*) FROM post_fts WHERE post_fts MATCH :match"),
+            {"match": match}).scalar()
+        return ids, total
+
+    def rebuild(self):
+        self.db.session.execute(text(
+            "INSERT INTO post_fts (post_fts) VALUES ('rebuild')"))
+        self.db.session.commit()
+
+
+def post_fts_ddl(post_table):
+    """Create and drop post_fts together with the post table in
+    metadata.create_all() and drop_all(), on SQLite only. Same table as the
+    3c1f0e5b9a2d migration"""
+    event.listen(post_table, "after_create", DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+        "body, content='post', content_rowid='id')").execute_if(dialect="sqlite"))
+    event.listen(post_table, "before_drop", DDL(
+        "DROP TABLE IF EXISTS post_fts").execute_if(dialect="sqlite"))
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic filter, the FTS5 tables are created by hand in a migration and
+    must not be dropped by flask db migrate because there is no model for them"""
+    return not (type_ == "table" and name.startswith("post_fts"))
+
+
+# Backends available for SEARCH_BACKEND
+backends = {"sqlite-fts5": SQLiteFTSBackend}
+
+
+def register_backend(name, backend_class):
+    """Make a SearchBackend subclass available as SEARCH_BACKEND=name"""
+    backends[name] = backend_class
+
+
+class Search(object):
+    """Search extension, it owns the backend selected in the configuration
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+        db (SQLAlchemy, optional): database of the application
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        name = app.config["SEARCH_BACKEND"]
+        if name is None and \
+                app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+            name = "sqlite-fts5"
+        app.extensions["search"] = backends[name](db) if name else None
+
+    @property
+    def backend(self):
+        """Backend of the current application, None when search is off"""
+        return current_app.extensions["search"]
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def add(self, connection, post):
+        backend = self.backend
+        if backend is not None:
+            backend.add(connection, post.id, post.body)
+
+    def remove(self, connection, post, body=None):
+        backend = self.backend
+        if backend is not None:
+            backend.remove(connection, post.id,
+                           post.body if body is None else body)
+
+    def search(self, query, page, per_page):
+        backend = self.backend
+        if backend is None:
+            return [], 0
+        return backend.search(query, page, per_page)
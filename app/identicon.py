@@ -0,0 +1,111 @@
+"""Identicons
+  Renders the same kind of image as gravatar's d=identicon option, so avatars
+  can be served by the app itself. The picture is a 5x5 grid, mirrored left to
+  right, whose cells and colour come from the MD5 digest of the email.
+  Images are PNG files written with zlib and struct from the standard library,
+  and stored in a disk cache because a digest and a size always give the same
+  image. Anyone can ask for any digest, so the cache has a maximum number of
+  files: each of its 256 directories keeps its newest share of them.
+"""
+import os
+import struct
+import zlib
+
+# Light grey background of every identicon
+BACKGROUND = (240, 240, 240)
+
+
+def _chunk(kind, data):
+    # length, type, data and CRC of the type and data, as the PNG spec says
+    return struct.pack(">I", len(data)) + kind + data + \
+        struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def render_png(digest, size):
+    """Draw the identicon of a digest
+
+    Args:
+        digest (str): 32 hexadecimal characters, MD5 of the email
+        size (int): width and height in pixels
+
+    Returns:
+        bytes: the PNG image
+    """
+    colour = tuple(int(digest[i:i + 2], 16) // 2 + 64 for i in (26, 28, 30))
+    # 15 cells decide the 3 left columns, the last 2 columns mirror them
+    cells = [[int(digest[column * 5 + row], 16) % 2 == 0 for column in range(3)]
+             for row in range(5)]
+    cells = [row + row[1::-1] for row in cells]
+    # Half a cell of margin on each side
+    cell = size / 6.0
+    # Grid column of each pixel column, None in the margin
+    columns = [int(x / cell - 0.5) if 0 <= x / cell - 0.5 < 5 else None
+               for x in range(size)]
+    # Only 6 different scanlines exist (5 grid rows and the margin), each one
+    # is built once
+    scanlines = {}
+    lines = []
+    for y in range(size):
+        row = int(y / cell - 0.5) if 0 <= y / cell - 0.5 < 5 else None
+        if row not in scanlines:
+            line = bytearray(b"\x00")  # filter type 0 for every scanline
+            for column in columns:
+                on = row is not None and column is not None and cells[row][column]
+                line += bytes(colour if on else BACKGROUND)
+            scanlines[row] = bytes(line)
+        lines.append(scanlines[row])
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)  # 8 bit RGB
+    return b"\x89PNG\r\n\x1a\n" + _chunk(b"IHDR", header) + \
+        _chunk(b"IDAT", zlib.compress(b"".join(lines), 9)) + _chunk(b"IEND", b"")
+
+
+def _prune(directory, limit):
+    # The oldest images go first, another process can remove them too
+    entries = []
+    with os.scandir(directory) as files:
+        for entry in files:
+            if entry.name.endswith(".png"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+    if len(entries) <= limit:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - limit]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def cached_png(directory, digest, size, max_files):
+    """Return the identicon from the disk cache, rendering it on a miss
+
+    Args:
+        directory (str): root of the disk cache
+        digest (str): 32 hexadecimal characters, MD5 of the email
+        size (int): width and height in pixels
+        max_files (int): images kept in the cache
+
+    Returns:
+        bytes: the PNG image
+    """
+    # Two levels so a directory doesn't end up with millions of files
+    path = os.path.join(directory, digest[:2], "{}-{}.png".format(digest, size))
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    data = render_png(digest, size)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary name and rename, readers never see half a file
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary, "wb") as f:
+        f.write(data)
+    os.replace(temporary, path)
+    # The digests are evenly spread over the directories, each one holds
+    # its share of max_files
+    _prune(os.path.dirname(path), max(1, max_files // 256))
+    return data
@@ -0,0 +1,162 @@
+"""Last seen tracking
+  Writing user.last_seen with a commit on every request takes the database
+  write lock for every page view. The tracker keeps the new values in memory
+  and writes them all together with a single executemany UPDATE, every
+  LAST_SEEN_FLUSH_INTERVAL seconds or when LAST_SEEN_FLUSH_SIZE users are
+  waiting. A user is only recorded again when the known value is older than
+  LAST_SEEN_GRANULARITY seconds.
+  Each application has its own buffer, kept in app.extensions.
+"""
+import atexit
+import threading
+from datetime import datetime, timedelta
+from time import monotonic
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class LastSeenBuffer(object):
+    """Buffer of the last_seen updates of one application
+
+    Args:
+        app (Flask): the application, its database gets the updates
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.granularity = timedelta(seconds=app.config['LAST_SEEN_GRANULARITY'])
+        self.flush_interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        self.flush_size = app.config['LAST_SEEN_FLUSH_SIZE']
+        self._lock = threading.Lock()
+        # user id -> datetime not written to the database yet
+        self._pending = {}
+        # user id -> last datetime recorded by this process, used to skip
+        # users seen less than granularity ago and to show fresh values
+        self._recorded = {}
+        self._last_flush = monotonic()
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+
+    def last_seen(self, user):
+        recorded = self._recorded.get(user.id)
+        if recorded is not None and (user.last_seen is None or recorded > user.last_seen):
+            return recorded
+        return user.last_seen
+
+    def touch(self, user):
+        if self.record(user):
+            self.flush()
+
+    def record(self, user):
+        # True when a flush is due
+        now = datetime.utcnow()
+        seen = self.last_seen(user)
+        if seen is not None and now - seen < self.granularity:
+            return False
+        with self._lock:
+            self._pending[user.id] = now
+            self._recorded[user.id] = now
+            return len(self._pending) >= self.flush_size or \
+                monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        # Inside an application context of this buffer's application
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = monotonic()
+            # Older values don't help to skip writes anymore
+            limit = datetime.utcnow() - self.granularity
+            self._recorded = {id: seen for id, seen in self._recorded.items()
+                              if seen > limit}
+        if not pending:
+            return
+        # Imported here to avoid circular imports, models imports the app package
+        from app import db
+        from app.models import User
+        table = User.__table__
+        statement = table.update().where(table.c.id == bindparam('user_id')) \
+            .values(last_seen=bindparam('seen'))
+        # A connection of its own, this doesn't touch the request session
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, [
+                    {'user_id': id, 'seen': seen} for id, seen in pending.items()])
+            self.flushes += 1
+            self.written += len(pending)
+        except SQLAlchemyError:
+            self.failures += 1
+            # Keep the values for the next flush, last_seen is not worth
+            # failing the request for
+            self.app.logger.exception('Could not write last_seen')
+            with self._lock:
+                for id, seen in pending.items():
+                    self._pending.setdefault(id, seen)
+
+    def stats(self):
+        return {'flushes': self.flushes, 'written': self.written,
+                'failures': self.failures, 'pending': len(self._pending)}
+
+    def flush_at_exit(self):
+        with self.app.app_context():
+            self.flush()
+
+
+class LastSeenTracker(object):
+    """Buffer of last_seen updates, set up like the other Flask extensions.
+    The methods use the buffer of the current application
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        buffer = app.extensions['last_seen'] = LastSeenBuffer(app)
+        # Don't lose the buffered values when the process stops
+        atexit.register(buffer.flush_at_exit)
+
+    @staticmethod
+    def _buffer():
+        return current_app.extensions['last_seen']
+
+    def last_seen(self, user):
+        """Most recent last seen value known for a user, including the values
+        still waiting in the buffer"""
+        return self._buffer().last_seen(user)
+
+    def touch(self, user):
+        """Record that the user has been seen now
+
+        Args:
+            user (User): the authenticated user of the request
+        """
+        self._buffer().touch(user)
+
+    def record(self, user):
+        """Buffer the new value without writing it, for the callers that run
+        flush() themselves (the event loop of app/asgi.py)
+
+        Args:
+            user (object): the user, or a row with its id and last_seen
+
+        Returns:
+            bool: True when a flush is due
+        """
+        return self._buffer().record(user)
+
+    def flush(self):
+        """Write the buffered values with one UPDATE statement"""
+        self._buffer().flush()
+
+    def stats(self):
+        """Counters of the buffer, for monitoring
+
+        Returns:
+            dict: flushes, rows written, failed flushes and pending users
+        """
+        return self._buffer().stats()
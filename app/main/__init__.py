@@ -0,0 +1,7 @@
+"""Timelines, profiles, search and avatars"""
+from flask import Blueprint
+
+bp = Blueprint('main', __name__)
+
+# Imported at the bottom, routes uses bp
+from app.main import routes
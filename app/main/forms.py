@@ -0,0 +1,25 @@
+"""Module to store the web form classes of the main blueprint"""
+# To work with forms
+from flask_wtf import FlaskForm
+# Import the classes to create the objects in the form
+from wtforms import StringField, TextAreaField, SubmitField
+# Import this to attach validation to the fields
+from wtforms.validators import DataRequired, Length
+
+
+# We build the class to manage the Edit profile form
+class EditProfileForm(FlaskForm):
+    username = StringField('Username', validators=[DataRequired()])
+    about_me = TextAreaField('About me', validators=[Length(min=0, max=140)])
+    submit = SubmitField('Submit')
+
+# New post, from the home page
+class PostForm(FlaskForm):
+    post = TextAreaField('Say something', validators=[
+        DataRequired(), Length(min=1, max=140)])
+    submit = SubmitField('Submit')
+
+# Form with only a submit button, used for the follow and unfollow actions.
+# Actions that change data are sent as POST requests with a CSRF token
+class EmptyForm(FlaskForm):
+    submit = SubmitField('Submit')
@@ -0,0 +1,247 @@
+"""Routes
+  Different URLs the app implements.
+  Handlers for the app routes are written as Python functions, called view functions. These are mapped
+  to one or more route URLs
+  @ -> decorators
+Returns:
+"""
+# Import render_template to call the htmls inside teh templates folder
+# flash to show messages
+# redirect to send to another web page
+# url_for to generate URLs using an internal mapping of URLs to views functions.
+# flask provides a request variables that contains all the information
+# that the client sent with the request
+# current_app is the application handling the request
+from flask import render_template, flash, redirect, url_for, request, abort, \
+    make_response, current_app
+# We have to import current_user from flask-login
+# login_required to protect functions to be accessed by not logged-in users
+from flask_login import current_user, login_required
+#from app import db and the extensions
+from app import db, last_seen, search, fragments, post_writer, replicas
+# The routes are registered on the blueprint, not on an application
+from app.main import bp
+#Import the classes from the forms module
+from app.main.forms import EditProfileForm, EmptyForm, PostForm
+# Import the class User from app/models.py
+from app.models import User, Post, load_posts, post_authors_select
+# Keyset (cursor) pagination for the post lists
+from app.pagination import decode_cursor
+# Raised when a new post was withdrawn after waiting too long
+from app.post_writer import WriteTimeout
+# Locally rendered avatars
+from app import identicon
+# 304 Not Modified answers for the timeline and profile pages
+from app.conditional import etag_for, form_epoch, not_modified, add_validators
+import re
+
+# decorator modifies the function that follows it
+# creates an association between the route and the function
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
+# Flask-Login protects a view function against anonymous users with this decorator
+# which redirects to the login page. But adding some extra information, a query 
+# string argument to this URL making the redirect: /login?next=/index.
+# Next query string argument is set to the original URL, so the app can use that
+# to redirect back after login
+@login_required
+def index(): #1
+    #return "Hello, World!" #1
+    form = PostForm()
+    if form.validate_on_submit():
+        try:
+            # Waits until the batch holding the post is committed
+            id = post_writer.write(current_user.id, form.post.data)
+        except WriteTimeout:
+            # Nothing was written, the page is rendered below with the text
+            # still in the form so it can be sent again
+            flash('Your post could not be saved, please try again.')
+        else:
+            # The post was written by another session, the next pages still
+            # have to come from the primary database
+            replicas.mark_write()
+            if id is None:
+                # Still committing: sending it again would make a duplicate
+                flash('Your post is being saved, it will show up in a moment.')
+            else:
+                flash('Your post is now live!')
+            # Post/Redirect/Get: reloading the page doesn't post again
+            return redirect(url_for('main.index'))
+    # ?before=<timestamp,id> is the cursor of the last post of the previous page
+    try:
+        before = decode_cursor(request.args.get('before'))
+    except ValueError:
+        abort(400)
+    # Own posts and posts of the followed users, precomputed on write. Only
+    # their keys for now, the posts are loaded when the page is rendered
+    keys, next_cursor = current_user.timeline_page(
+        before, current_app.config['POSTS_PER_PAGE'])
+    ids = [id for _, id in keys]
+    # The page changes with the posts it shows, the profiles of their
+    # authors (a new username or avatar) and our own profile. If the client
+    # has that version, answer 304 without rendering. There is no
+    # Last-Modified, the date of the newest post misses the profile changes
+    etag = etag_for('index', current_user.id, current_user.profile_version,
+                    [tuple(row) for row in db.session.execute(post_authors_select(ids))],
+                    next_cursor, current_app.config['AVATAR_SOURCE'], form_epoch())
+    # A form sent back with errors is always rendered
+    response = None if form.is_submitted() else not_modified(etag)
+    if response is not None:
+        return response
+    posts = load_posts(ids)
+    next_url = url_for('main.index', before=next_cursor) if next_cursor else None
+    return add_validators(make_response(render_template(
+        'index.html', title='Home Page', form=form, posts=posts,
+        next_url=next_url)), etag)
+
+# User profile page
+# The decorator has a dynamic component <username>. Flask will accept any text
+# in that portion of the URL
+@bp.route('/user/<username>')
+# View only accesible to logged in users
+@login_required
+def user(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    try:
+        before = decode_cursor(request.args.get('before'))
+    except ValueError:
+        abort(400)
+    # The last visit can still be in the tracker buffer
+    seen = last_seen.last_seen(user)
+    # Validators: the profile, the newest post and who is looking at it. No
+    # Last-Modified, the date of the newest post misses the profile changes
+    newest = user.posts.with_entities(Post.timestamp, Post.id) \
+        .order_by(Post.timestamp.desc(), Post.id.desc()).first()
+    newest = tuple(newest) if newest else (None, None)
+    etag = etag_for('user', user.id, user.profile_version, user.follower_count,
+                    seen, newest, current_user.id, current_user.profile_version,
+                    current_app.config['AVATAR_SOURCE'], form_epoch())
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    # Newest posts of the user, one page at a time
+    posts, next_cursor = user.posts_page(before, current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.user', username=username, before=next_cursor) \
+        if next_cursor else None
+    form = EmptyForm()
+    return add_validators(make_response(render_template(
+        'user.html', user=user, posts=posts, form=form, last_seen=seen,
+        next_url=next_url)), etag)
+
+# Record time of last visit
+@bp.before_app_request
+def before_request():
+    # Static files and URLs that don't exist (404) don't count as a visit
+    if request.endpoint in (None, 'static'):
+        return
+    if current_user.is_authenticated:
+        # When we reference current_user, Flask-Login will invoke the user
+        # loader callback function, which will run a db query that will put 
+        # the target user in the db session.
+        # The tracker buffers the new value and writes it later together with
+        # the values of other users, no commit here
+        last_seen.touch(current_user)
+
+# Function that ties form and template together
+@bp.route('/edit_profile', methods=['GET', 'POST'])
+@login_required
+def edit_profile():
+    form = EditProfileForm()
+    # If validate on submit return True we copy the data from the form into the
+    # user object and write the object to the db.
+    if form.validate_on_submit():
+        current_user.username = form.username.data
+        current_user.about_me = form.about_me.data
+        # Incremented by the database, current_user can be an older copy
+        # from the user cache of this worker
+        current_user.profile_version = User.profile_version + 1
+        db.session.commit()
+        # The cached posts of this user show the old username
+        fragments.invalidate_author(current_user.id)
+        flash('Your changes have been saved.')
+        return redirect(url_for('main.edit_profile'))
+    # If return false could be because the browser send a GET request
+    # I need to respond by providing an initial version of the form template
+    elif request.method == 'GET':
+        form.username.data = current_user.username
+        form.about_me.data = current_user.about_me
+    # POST request with form data but something in the data is invalid
+    return render_template('edit_profile.html', title='Edit Profile', form=form)
+
+# Follow and unfollow change the follower graph, so they only accept POST
+# requests coming from the buttons on the profile page
+@bp.route('/follow/<username>', methods=['POST'])
+@login_required
+def follow(username):
+    form = EmptyForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(username=username).first_or_404()
+        if user == current_user:
+            flash('You cannot follow yourself!')
+            return redirect(url_for('main.user', username=username))
+        current_user.follow(user)
+        db.session.commit()
+        # follow() changed our profile_version, the cached posts under the
+        # old one would never be shown again
+        fragments.invalidate_author(current_user.id)
+        flash('You are following {}!'.format(username))
+        return redirect(url_for('main.user', username=username))
+    return redirect(url_for('main.index'))
+
+@bp.route('/unfollow/<username>', methods=['POST'])
+@login_required
+def unfollow(username):
+    form = EmptyForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(username=username).first_or_404()
+        if user == current_user:
+            flash('You cannot unfollow yourself!')
+            return redirect(url_for('main.user', username=username))
+        current_user.unfollow(user)
+        db.session.commit()
+        fragments.invalidate_author(current_user.id)
+        flash('You are not following {}.'.format(username))
+        return redirect(url_for('main.user', username=username))
+    return redirect(url_for('main.index'))
+
+# Identicons served by the app itself when AVATAR_SOURCE is 'local'.
+# The image of a digest and size never changes, so browsers and proxies can
+# keep it for a long time and revalidate it with the ETag.
+# No login is needed, only the sizes of the pages are drawn and the disk
+# cache is bounded by AVATAR_CACHE_MAX_FILES.
+@bp.route('/avatar/<digest>/<int:size>')
+def avatar(digest, size):
+    if not re.fullmatch('[0-9a-f]{32}', digest) or \
+            size not in current_app.config['AVATAR_SIZES']:
+        abort(404)
+    data = identicon.cached_png(current_app.config['AVATAR_CACHE_DIR'], digest, size,
+                                current_app.config['AVATAR_CACHE_MAX_FILES'])
+    response = make_response(data)
+    response.mimetype = 'image/png'
+    response.set_etag('{}-{}'.format(digest, size))
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['AVATAR_MAX_AGE']
+    # Answers 304 Not Modified when the client sends a matching If-None-Match
+    return response.make_conditional(request)
+
+# Full-text search of the posts, ?q=words&page=n
+@bp.route('/search')
+@login_required
+def search_posts():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
+    per_page = current_app.config['SEARCH_RESULTS_PER_PAGE']
+    ids, total = search.search(q, page, per_page)
+    # The backend gives the ids by relevance, the posts are loaded in one
+    # query and put back in that order
+    by_id = {post.id: post for post in Post.query.options(
+        db.joinedload(Post.author)).filter(Post.id.in_(ids))} if ids else {}
+    posts = [by_id[id] for id in ids if id in by_id]
+    next_url = url_for('main.search_posts', q=q, page=page + 1) \
+        if total > page * per_page else None
+    prev_url = url_for('main.search_posts', q=q, page=page - 1) if page > 1 else None
+    return render_template('search.html', title='Search', q=q, posts=posts,
+                           total=total, next_url=next_url, prev_url=prev_url,
+                           enabled=search.enabled)
@@ -0,0 +1,308 @@
+"""Request metrics
+  For every request, the number of SQL queries, the time spent in the database
+  and in the templates, and the total time, grouped by endpoint. The numbers
+  come from the SQLAlchemy engine events and the Flask template signals.
+  /metrics shows them in the Prometheus text format, together with the
+  counters of the caches and buffers registered with register(). With
+  METRICS_SERVER_TIMING each response also gets a Server-Timing header, that
+  the browser developer tools show next to the request.
+  Queries slower than METRICS_SLOW_QUERY seconds are logged with their
+  statement. The time and endpoint of the last METRICS_SLOW_QUERY_SAMPLES
+  are listed as comments at the end of /metrics, the statements stay in the
+  log.
+  /metrics (and /server-status of flask serve) only answer the addresses of
+  METRICS_ALLOWED_IPS and the requests with the METRICS_TOKEN bearer token.
+  With METRICS_ENABLED off (the default) nothing is hooked at all.
+  The numbers are kept per process, and per application in app.extensions.
+"""
+import hmac
+import threading
+from collections import deque
+from time import perf_counter
+from flask import g, request, has_app_context, before_render_template, \
+    template_rendered, Response, abort, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.tokens import bearer_token
+
+# Upper bounds (seconds) of the request duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestState(object):
+    """What the current request did so far, kept in flask.g"""
+
+    __slots__ = ('start', 'queries', 'db_time', 'template_time', 'depth',
+                 'template_start')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # Templates render other templates (render_post), only the outermost
+        # one is timed
+        self.depth = 0
+        self.template_start = None
+
+
+class EndpointStats(object):
+    """Totals of the requests of one endpoint"""
+
+    __slots__ = ('count', 'duration', 'buckets', 'queries', 'db_time',
+                 'template_time', 'slow_queries')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.slow_queries = 0
+
+
+def check_access():
+    """403 unless the request comes from METRICS_ALLOWED_IPS or carries
+    the METRICS_TOKEN bearer token. The monitoring pages show the traffic
+    and the internals of the site"""
+    config = current_app.config
+    allowed = [ip.strip() for ip in config['METRICS_ALLOWED_IPS'].split(',')]
+    if request.remote_addr in allowed:
+        return
+    token = bearer_token(request)
+    if config['METRICS_TOKEN'] and token is not None and hmac.compare_digest(
+            token.encode('utf-8'), config['METRICS_TOKEN'].encode('utf-8')):
+        return
+    abort(403)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class AppMetrics(object):
+    """Numbers and collectors of one application
+
+    Args:
+        app (Flask): the application
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.server_timing = app.config['METRICS_SERVER_TIMING']
+        self.slow_query = app.config['METRICS_SLOW_QUERY']
+        self.slow_queries = deque(maxlen=app.config['METRICS_SLOW_QUERY_SAMPLES'])
+        self._lock = threading.Lock()
+        # endpoint -> EndpointStats
+        self._endpoints = {}
+        # (endpoint, status code) -> responses
+        self._responses = {}
+        # name -> (function returning a dict of numbers, keys that are counters)
+        self.collectors = {}
+
+    def _start(self):
+        g._metrics = RequestState()
+
+    @staticmethod
+    def _state():
+        return g.get('_metrics')
+
+    def query(self, elapsed, statement):
+        state = self._state()
+        if state is not None:
+            state.queries += 1
+            state.db_time += elapsed
+        if elapsed >= self.slow_query:
+            endpoint = request.endpoint if state is not None else None
+            self.app.logger.warning('Slow query (%.3fs) in %s: %s',
+                                    elapsed, endpoint, statement)
+            self.slow_queries.append((elapsed, endpoint))
+            if state is not None:
+                with self._lock:
+                    self._endpoint(endpoint).slow_queries += 1
+
+    def _before_template(self, sender, template, context, **extra):
+        state = self._state()
+        if state is not None:
+            if state.depth == 0:
+                state.template_start = perf_counter()
+            state.depth += 1
+
+    def _after_template(self, sender, template, context, **extra):
+        state = self._state()
+        if state is not None and state.depth:
+            state.depth -= 1
+            if state.depth == 0:
+                state.template_time += perf_counter() - state.template_start
+
+    def _endpoint(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def _finish(self, response):
+        state = g.pop('_metrics', None)
+        if state is None:
+            return response
+        # A streamed body is still being generated at this point, its time
+        # is not included
+        duration = perf_counter() - state.start
+        endpoint = request.endpoint
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.count += 1
+            stats.duration += duration
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.queries += state.queries
+            stats.db_time += state.db_time
+            stats.template_time += state.template_time
+            key = (endpoint, response.status_code)
+            self._responses[key] = self._responses.get(key, 0) + 1
+        if self.server_timing:
+            response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries", '
+                                 'tpl;dur={:.2f}, app;dur={:.2f}'.format(
+                                     state.db_time * 1000, state.queries,
+                                     state.template_time * 1000, duration * 1000))
+        return response
+
+    def render(self):
+        with self._lock:
+            endpoints = {endpoint: (stats.count, stats.duration, list(stats.buckets),
+                                    stats.queries, stats.db_time, stats.template_time,
+                                    stats.slow_queries)
+                         for endpoint, stats in self._endpoints.items()}
+            responses = dict(self._responses)
+        lines = []
+
+        def metric(name, type, help, samples):
+            lines.append('# HELP microblog_{} {}'.format(name, help))
+            lines.append('# TYPE microblog_{} {}'.format(name, type))
+            for labels, value in samples:
+                labels = ','.join('{}="{}"'.format(key, _label(label))
+                                  for key, label in labels)
+                lines.append('microblog_{}{} {}'.format(
+                    name, '{' + labels + '}' if labels else '', value))
+
+        metric('responses_total', 'counter', 'Responses by endpoint and status code',
+               [((('endpoint', endpoint), ('status', status)), count)
+                for (endpoint, status), count in sorted(responses.items(), key=str)])
+        lines.append('# HELP microblog_request_duration_seconds Time to build the response')
+        lines.append('# TYPE microblog_request_duration_seconds histogram')
+        for endpoint, (count, duration, buckets, *_) in sorted(endpoints.items(), key=str):
+            label = _label(endpoint)
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append('microblog_request_duration_seconds_bucket'
+                             '{{endpoint="{}",le="{}"}} {}'.format(label, bound, cumulative))
+            lines.append('microblog_request_duration_seconds_bucket'
+                         '{{endpoint="{}",le="+Inf"}} {}'.format(label, count))
+            lines.append('microblog_request_duration_seconds_sum'
+                         '{{endpoint="{}"}} {}'.format(label, duration))
+            lines.append('microblog_request_duration_seconds_count'
+                         '{{endpoint="{}"}} {}'.format(label, count))
+        for index, name, help in (
+                (3, 'db_queries_total', 'SQL queries run by the requests'),
+                (4, 'db_seconds_total', 'Time spent running SQL queries'),
+                (5, 'template_seconds_total', 'Time spent rendering templates'),
+                (6, 'db_slow_queries_total', 'Queries slower than METRICS_SLOW_QUERY')):
+            metric(name, 'counter', help, [
+                ((('endpoint', endpoint),), values[index])
+                for endpoint, values in sorted(endpoints.items(), key=str)])
+        for prefix, (function, counters) in sorted(self.collectors.items()):
+            for key, value in sorted(function().items()):
+                if key in counters:
+                    metric('{}_{}_total'.format(prefix, key), 'counter',
+                           '{} of {}'.format(key, prefix), [((), value)])
+                else:
+                    metric('{}_{}'.format(prefix, key), 'gauge',
+                           '{} of {}'.format(key, prefix), [((), value)])
+        for elapsed, endpoint in list(self.slow_queries):
+            lines.append('# slow query {:.3f}s {}'.format(elapsed, endpoint))
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        check_access()
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+class Metrics(object):
+    """Per-request SQL and timing instrumentation, served at /metrics
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['METRICS_ENABLED']:
+            return
+        metrics = app.extensions['metrics'] = AppMetrics(app)
+        # Listening on the Engine class covers every engine, also the ones
+        # created later. Once, when several applications share the extension,
+        # a query is counted by the application of the current context
+        if not event.contains(Engine, 'before_cursor_execute', self._before_query):
+            event.listen(Engine, 'before_cursor_execute', self._before_query)
+            event.listen(Engine, 'after_cursor_execute', self._after_query)
+        before_render_template.connect(metrics._before_template, app)
+        template_rendered.connect(metrics._after_template, app)
+        app.before_request(metrics._start)
+        app.after_request(metrics._finish)
+        app.add_url_rule('/metrics', 'metrics', metrics.view)
+
+    @property
+    def enabled(self):
+        """Whether the current application has METRICS_ENABLED"""
+        return 'metrics' in current_app.extensions
+
+    def register(self, name, function, counters=(), app=None):
+        """Export the numbers returned by function()
+
+        Args:
+            name (str): prefix of the metric names, like user_cache
+            function (callable): returns a dict of numbers, like stats()
+            counters (tuple, optional): keys of the numbers that only grow,
+                exported as counters (name_key_total). The others are
+                gauges. Defaults to ()
+            app (Flask, optional): application that exports them. Defaults
+                to the current application
+        """
+        metrics = (app or current_app).extensions.get('metrics')
+        if metrics is not None:
+            metrics.collectors[name] = (function, frozenset(counters))
+
+    def render(self):
+        """The metrics of the current application in the Prometheus text
+        exposition format
+
+        Returns:
+            str: one line per sample, with the HELP and TYPE comments
+        """
+        return current_app.extensions['metrics'].render()
+
+    @staticmethod
+    def _before_query(conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context, which goes away with the statement.
+        # A statement that raises never gets its after_cursor_execute
+        if context is not None:
+            context._metrics_start = perf_counter()
+
+    @staticmethod
+    def _after_query(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_metrics_start', None)
+        if start is None:
+            return
+        elapsed = perf_counter() - start
+        # Queries outside of an application context belong to no application
+        if has_app_context():
+            metrics = current_app.extensions.get('metrics')
+            if metrics is not None:
+                metrics.query(elapsed, statement)
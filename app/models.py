@@ -7,7 +7,14 @@ Returns:
 """
 # We need to import daytime to use datetime.utcnow function
 from datetime import datetime
-from app import db, login
+from flask import current_app, url_for
+from app import db, login, user_cache, search, tokens
+# Authorization: Bearer header of the API calls
+from app.tokens import bearer_token
+# Keyset pagination is also used to page the home timeline
+from app.pagination import encode_cursor, keyset_page, keyset_select
+# The FTS5 index table is part of the schema of the post table
+from app.fulltext import post_fts_ddl
 
 # Import the class UserMixin to implement is_authenticated, is_active,
 # is_anonymous and get_id, which are the requirements for flask_login to work
@@ -19,6 +26,32 @@ from werkzeug.security import generate_password_hash, check_password_hash
 # To generate an avatar
 from hashlib import md5
 
+# Association table for the followers relationship. It has no model class
+# because it only holds the two foreign keys. A row means that follower_id
+# follows followed_id.
+followers = db.Table(
+    "followers",
+    db.Column("follower_id", db.Integer, db.ForeignKey("user.id"), primary_key=True),
+    db.Column("followed_id", db.Integer, db.ForeignKey("user.id"), primary_key=True),
+    # The primary key index serves "who do I follow", this one serves
+    # "who follows me", the query run when a post is fanned out
+    db.Index("ix_followers_followed_id", "followed_id"),
+)
+
+
+def email_digest(email):
+    return md5(email.lower().encode("utf-8")).hexdigest()
+
+
+def avatar_url(digest, size):
+    """URL of the avatar of an email digest, shared by User.avatar() and the
+    API, which has the digest without a User object"""
+    # Identicons rendered by this app, see the avatar() view
+    if current_app.config["AVATAR_SOURCE"] == "local":
+        return url_for("main.avatar", digest=digest, size=size)
+    return f"https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}"
+
+
 # Model representing users, inherits from db.Model, a base class for all models
 # from Flask-SQLAlchemy. Fields are create as instances of the db.Column class which
 # takes several arguments
@@ -27,6 +60,9 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
+    # MD5 of the lowercased email, used in the avatar URLs. It's computed
+    # once when the email is set instead of on every avatar() call
+    email_hash = db.Column(db.String(32))
     # We will not be storing user passwords in the DB
     password_hash = db.Column(db.String(128))
     # The model is referenced by the model class Post.
@@ -42,23 +78,171 @@ class User(UserMixin, db.Model):
     posts = db.relationship("Post", backref="author", lazy="dynamic")
     # New fields. We will need to generate a database migration
     about_me = db.Column(db.String(140))
+    # Incremented every time the profile is edited. Cached things that show
+    # the profile (rendered posts) include it in their keys
+    profile_version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # Part of every API token of the user. Incrementing it revokes all the
+    # tokens issued before, see app/tokens.py
+    token_version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # Denormalized number of followers, kept by follow()/unfollow(). It decides
+    # if the posts of this user are pushed to the timelines of the followers
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Many to many relationship between users through the followers table.
+    # user.followed are the users this user follows, the backref
+    # user.followers are the users that follow this user.
+    followed = db.relationship(
+        "User", secondary=followers,
+        primaryjoin=(followers.c.follower_id == id),
+        secondaryjoin=(followers.c.followed_id == id),
+        backref=db.backref("followers", lazy="dynamic"), lazy="dynamic")
 
     # __repr__ method tells Python how to print objects of this class.
     def __repr__(self):
         return "<User {}>".format(self.username)
 
-    # method to generate a password hash
+    # method to generate a password hash. The algorithm and its work factor
+    # come from the configuration (PASSWORD_HASH_METHOD)
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(
+            password, method=current_app.config["PASSWORD_HASH_METHOD"],
+            salt_length=current_app.config["PASSWORD_SALT_LENGTH"])
 
     # function to check if the password inserted is correct or not
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def password_needs_rehash(self):
+        """True when the stored hash was made with other parameters than the
+        configured ones. The hash looks like method$salt$hash, for example
+        pbkdf2:sha256:260000$salt$hash"""
+        method, _, rest = (self.password_hash or "").partition("$")
+        salt = rest.partition("$")[0]
+        target = current_app.config["PASSWORD_HASH_METHOD"]
+        # A method without work factor ("pbkdf2:sha256") means the werkzeug
+        # default, which werkzeug writes in the hash
+        if method != target and not method.startswith(target + ":"):
+            return True
+        return len(salt) != current_app.config["PASSWORD_SALT_LENGTH"]
+
+    # Runs every time the email attribute is assigned
+    @db.validates("email")
+    def validate_email(self, key, email):
+        self.email_hash = email_digest(email) if email else None
+        return email
+
     def avatar(self, size):
-        digest = md5(self.email.lower().encode("utf-8")).hexdigest()
-        return f"https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}"
+        return avatar_url(self.email_hash or email_digest(self.email), size)
+
+    def is_following(self, user):
+        return self.followed.filter(followers.c.followed_id == user.id).count() > 0
+
+    def follow(self, user):
+        if not self.is_following(user):
+            # Copy the recent posts of the new followed user into our timeline,
+            # otherwise they would only show up from the next post on
+            if not user.is_high_fanout():
+                backfill = db.select(
+                    db.literal(self.id), Post.id, Post.timestamp
+                ).where(Post.user_id == user.id).order_by(
+                    Post.timestamp.desc()
+                ).limit(current_app.config["TIMELINE_BACKFILL"])
+                db.session.execute(TimelineEntry.__table__.insert().from_select(
+                    ["user_id", "post_id", "timestamp"], backfill))
+            self.followed.append(user)
+            # Incremented by the database, two concurrent follows don't lose one
+            user.follower_count = User.follower_count + 1
+            # The followed users are part of our profile page. Incremented by
+            # the database too: this object can come from the user cache of a
+            # worker that missed the last change, a version computed here
+            # could be one that already stands for another profile
+            self.profile_version = User.profile_version + 1
+
+    def unfollow(self, user):
+        if self.is_following(user):
+            self.followed.remove(user)
+            user.follower_count = User.follower_count - 1
+            self.profile_version = User.profile_version + 1
+            db.session.execute(TimelineEntry.__table__.delete().where(
+                TimelineEntry.user_id == self.id).where(
+                TimelineEntry.post_id.in_(
+                    db.select(Post.id).where(Post.user_id == user.id))))
+
+    def is_high_fanout(self):
+        """Users with more followers than TIMELINE_FANOUT_LIMIT are not pushed
+        to the timelines of their followers. Their posts are pulled when the
+        timeline is read, so a single post doesn't write a timeline row for
+        every follower."""
+        return (self.follower_count or 0) > current_app.config["TIMELINE_FANOUT_LIMIT"]
+
+    def posts_page(self, before, per_page):
+        """Posts written by this user, newest first, read through the
+        (user_id, timestamp, id) index of the post table
+
+        Args:
+            before (tuple): decoded (timestamp, id) cursor or None
+            per_page (int): number of posts per page
+
+        Returns:
+            tuple: (posts, next_cursor)
+        """
+        return keyset_page(self.posts, Post.timestamp, Post.id, before, per_page)
+
+    def timeline_keys(self, before, limit):
+        """(timestamp, post id) of the newest posts of the home timeline
+
+        Most of it is a single range read of the precomputed timeline_entry
+        rows of this user. Posts of followed high fan-out users are read
+        from the post table and merged in.
+
+        Args:
+            before (tuple): decoded (timestamp, id) cursor or None
+            limit (int): maximum number of keys
+
+        Returns:
+            list: keys from newest to oldest
+        """
+        pushed = db.session.execute(
+            timeline_entries_select(self.id, before, limit)).all()
+        # One index range read per followed high fan-out user, each already
+        # in order, instead of sorting all their posts together
+        pulled = []
+        for author_id in db.session.execute(
+                high_fanout_followed_select(self.id)).scalars().all():
+            pulled += db.session.execute(
+                post_keys_select(author_id, before, limit)).all()
+        return merge_timeline_keys(pushed, pulled, limit)
+
+    def timeline_page(self, before, per_page):
+        """Keys of one page of the home timeline, without loading the posts
+
+        Args:
+            before (tuple): decoded (timestamp, id) cursor or None
+            per_page (int): number of posts per page
+
+        Returns:
+            tuple: (keys from newest to oldest, next_cursor)
+        """
+        # One extra key tells if there is a next page
+        keys = self.timeline_keys(before, per_page + 1)
+        next_cursor = None
+        if len(keys) > per_page:
+            keys = keys[:per_page]
+            next_cursor = encode_cursor(*keys[-1])
+        return keys, next_cursor
+
+    def timeline(self, before, per_page):
+        """Home timeline: own posts and posts of the followed users
+
+        Args:
+            before (tuple): decoded (timestamp, id) cursor or None
+            per_page (int): number of posts per page
+
+        Returns:
+            tuple: (posts, next_cursor)
+        """
+        keys, next_cursor = self.timeline_page(before, per_page)
+        return load_posts([id for _, id in keys]), next_cursor
 
 
 # The class Post represent blog posts written by users.
@@ -70,11 +254,95 @@ class Post(db.Model):
     # This field was inititialized as a foreign key to user.id. user is
     # the name of the database table for the model
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    # The posts of a user from newest to oldest (profile page) are a range of
+    # this index, already in the right order. id is the tie breaker of posts
+    # with the same timestamp
+    __table_args__ = (
+        db.Index("ix_post_user_id_timestamp", user_id, timestamp.desc(), id.desc()),
+    )
 
     def __repr__(self):
         return "<Post {}>".format(self.body)
 
 
+# Precomputed home timelines (fan-out on write). When a post is inserted, a row
+# is added here for the author and for each of the followers, so reading a home
+# timeline is a range read of the primary key instead of a join of posts and
+# followers.
+class TimelineEntry(db.Model):
+    __tablename__ = "timeline_entry"
+    # The owner of the timeline, not the author of the post
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    # Copy of post.timestamp, the primary key is the timeline order
+    timestamp = db.Column(db.DateTime, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("post.id"), primary_key=True)
+
+
+# The statements of User.timeline_keys(), also run by the async engine of
+# app/asgi.py
+def timeline_entries_select(user_id, before, limit):
+    """(timestamp, post_id) of the precomputed timeline rows of a user"""
+    return keyset_select(
+        db.select(TimelineEntry.timestamp, TimelineEntry.post_id).where(
+            TimelineEntry.user_id == user_id),
+        TimelineEntry.timestamp, TimelineEntry.post_id, before, limit)
+
+
+def high_fanout_followed_select(user_id):
+    """Ids of the high fan-out users followed by a user"""
+    return db.select(User.id).join(
+        followers, followers.c.followed_id == User.id).where(
+        followers.c.follower_id == user_id,
+        User.follower_count > current_app.config["TIMELINE_FANOUT_LIMIT"])
+
+
+def post_keys_select(user_id, before, limit):
+    """(timestamp, id) of the newest posts of a user"""
+    return keyset_select(db.select(Post.timestamp, Post.id).where(
+        Post.user_id == user_id), Post.timestamp, Post.id, before, limit)
+
+
+def post_authors_select(post_ids):
+    """(post id, author id, author profile_version) of some posts, what the
+    rendered posts depend on besides their immutable text"""
+    return db.select(Post.id, User.id, User.profile_version).join(
+        User, User.id == Post.user_id).where(
+        Post.id.in_(post_ids)).order_by(Post.id)
+
+
+def load_posts(post_ids):
+    """Posts with their authors, in the order of post_ids"""
+    by_id = {post.id: post for post in Post.query.options(
+        db.joinedload(Post.author)).filter(Post.id.in_(post_ids))}
+    return [by_id[id] for id in post_ids if id in by_id]
+
+
+def merge_timeline_keys(pushed, pulled, limit):
+    """Newest keys of the pushed and pulled timeline rows"""
+    # A post can be in both lists if its author crossed the fan-out limit
+    return sorted({tuple(row) for row in pushed + pulled}, reverse=True)[:limit]
+
+
+# Runs inside the flush that inserts a post, so the timeline rows are written
+# in the same transaction as the post. It's one INSERT ... SELECT whatever the
+# number of followers.
+@db.event.listens_for(Post, "after_insert")
+def fan_out_post(mapper, connection, post):
+    entries = TimelineEntry.__table__
+    connection.execute(entries.insert().values(
+        user_id=post.user_id, timestamp=post.timestamp, post_id=post.id))
+    author = connection.execute(
+        db.select(User.follower_count).where(User.id == post.user_id)).scalar()
+    if (author or 0) > current_app.config["TIMELINE_FANOUT_LIMIT"]:
+        # Followers will pull this post when they read their timeline
+        return
+    connection.execute(entries.insert().from_select(
+        ["user_id", "timestamp", "post_id"],
+        db.select(followers.c.follower_id, db.literal(post.timestamp),
+                  db.literal(post.id)).where(
+            followers.c.followed_id == post.user_id)))
+
+
 # The decorator register the user loader.
 # The extension expects that the app will configure a user loader function,
 # that can be callend to load a user given the ID
@@ -82,4 +350,74 @@ class Post(db.Model):
 def load_user(id):
     # Flask-Login passes id to the function as a string. Databases that use
     # numeric IDs need to convert it to Int
-    return User.query.get(int(id))
+    # The cache only queries the database on a miss
+    return user_cache.load(int(id))
+
+
+# Called by Flask-Login when the request has no session, for the API calls
+# with a bearer token. The signature is checked without the database and the
+# user comes from the cache, a service client costs no query per call
+@login.request_loader
+def load_user_from_request(request):
+    # The tokens are for the API, the HTML pages need a login
+    if request.blueprint != "api":
+        return None
+    token = bearer_token(request)
+    if token is None:
+        return None
+    identity = tokens.verify(token)
+    if identity is None:
+        return None
+    user_id, version = identity
+    user = user_cache.load(user_id)
+    # An older version means the token was revoked
+    if user is None or user.token_version != version:
+        return None
+    return user
+
+
+# db.create_all() creates the search index table with the post table
+post_fts_ddl(Post.__table__)
+
+
+# The search index is updated in the flush that writes the post, the index
+# and the table can't disagree after a commit or a rollback
+@db.event.listens_for(Post, "after_insert")
+def index_post(mapper, connection, post):
+    search.add(connection, post)
+
+
+@db.event.listens_for(Post, "after_update")
+def reindex_post(mapper, connection, post):
+    history = db.inspect(post).attrs.body.history
+    if history.has_changes():
+        search.remove(connection, post, history.deleted[0] if history.deleted else "")
+        search.add(connection, post)
+
+
+@db.event.listens_for(Post, "after_delete")
+def unindex_post(mapper, connection, post):
+    search.remove(connection, post)
+
+
+# Cached users must be dropped when their row changes, like edit_profile
+# changing username/about_me or set_password changing the hash. The changed
+# users are collected when the session flushes and removed from the cache
+# once the transaction is committed.
+@db.event.listens_for(db.session, "after_flush")
+def collect_changed_users(session, flush_context):
+    changed = session.info.setdefault("changed_users", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+@db.event.listens_for(db.session, "after_commit")
+def invalidate_changed_users(session):
+    for id in session.info.pop("changed_users", ()):
+        user_cache.invalidate(id)
+
+
+@db.event.listens_for(db.session, "after_rollback")
+def forget_changed_users(session):
+    session.info.pop("changed_users", None)
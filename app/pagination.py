@@ -0,0 +1,86 @@
+"""Keyset pagination helpers
+  Pages of posts are addressed with a cursor made of the (timestamp, id) of the
+  last row already shown, like ?before=2022-05-01T21:59:54.850323,42, instead of
+  a page number. The database seeks straight to the cursor through the index and
+  reads only per_page rows, so page 1000 costs the same as page 1. With OFFSET
+  the database has to walk and throw away every row of the previous pages.
+"""
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+def encode_cursor(timestamp, id):
+    """Build the value of the ?before= query string argument
+
+    Args:
+        timestamp (datetime): timestamp of the last row shown
+        id (int): primary key of the last row shown
+
+    Returns:
+        str: cursor string
+    """
+    return "{},{}".format(timestamp.isoformat(), id)
+
+
+def decode_cursor(value):
+    """Parse a cursor built by encode_cursor()
+
+    Args:
+        value (str): the ?before= query string argument
+
+    Raises:
+        ValueError: the cursor is malformed
+
+    Returns:
+        tuple: (timestamp, id) or None if value is empty
+    """
+    if not value:
+        return None
+    timestamp, _, id = value.rpartition(",")
+    return datetime.fromisoformat(timestamp), int(id)
+
+
+def keyset_select(statement, timestamp_column, id_column, before, limit):
+    """Same seek as keyset_page() for a Core select(), without running it
+
+    Args:
+        statement (Select): the select to paginate, without ORDER BY or LIMIT
+        timestamp_column (Column): first sort key, must be covered by an index
+        id_column (Column): tie breaker for rows with the same timestamp
+        before (tuple): decoded cursor or None for the first page
+        limit (int): number of rows to read
+
+    Returns:
+        Select: the statement with the WHERE, ORDER BY and LIMIT
+    """
+    if before is not None:
+        statement = statement.where(tuple_(timestamp_column, id_column) < before)
+    return statement.order_by(timestamp_column.desc(), id_column.desc()).limit(limit)
+
+
+def keyset_page(query, timestamp_column, id_column, before, per_page):
+    """Return one page of a query ordered from newest to oldest
+
+    Args:
+        query (Query): the query to paginate, without ORDER BY or LIMIT
+        timestamp_column (Column): first sort key, must be covered by an index
+        id_column (Column): tie breaker for rows with the same timestamp
+        before (tuple): decoded cursor or None for the first page
+        per_page (int): number of rows per page
+
+    Returns:
+        tuple: (rows, next_cursor). next_cursor is None on the last page
+    """
+    if before is not None:
+        # Row value comparison, the database turns it into an index range seek
+        query = query.filter(tuple_(timestamp_column, id_column) < before)
+    # One extra row tells us if there is a next page without running a COUNT
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()) \
+        .limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            getattr(last, timestamp_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
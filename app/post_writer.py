@@ -0,0 +1,209 @@
+"""Write-behind posts
+  Committing every new post in its own transaction costs one fsync per post,
+  and with SQLite one writer at a time. The requests hand their post to a
+  background thread instead and wait. The thread takes everything that
+  arrives within POST_WRITE_WINDOW seconds (up to POST_WRITE_BATCH_SIZE
+  posts) and inserts it in one transaction: many small commits become a few
+  large ones.
+  The request only answers once the transaction that holds its post is
+  committed, so the acknowledgement is as durable as a normal commit (with
+  SQLITE_SYNCHRONOUS=normal a power loss can still undo the last commits, use
+  full to avoid it).
+  When a batch fails, its posts are retried one by one so a bad post only
+  fails its own request.
+  A request waits at most POST_WRITE_TIMEOUT seconds. A post still in the
+  queue then is withdrawn (the user can send it again without making a
+  duplicate), one already taken by the thread is left to its commit.
+  Each application has its own queue and thread, kept in app.extensions, the
+  thread writes with the application it was started for.
+"""
+import atexit
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from time import monotonic
+from flask import current_app
+
+
+class WriteTimeout(Exception):
+    """The post waited too long in the queue and was withdrawn, nothing
+    was written"""
+
+
+class PostQueue(object):
+    """Queue and thread of the posts of one application
+
+    Args:
+        app (Flask): the application, its database gets the posts
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config['POST_WRITE_BATCH_SIZE']
+        self.window = app.config['POST_WRITE_WINDOW']
+        self.timeout = app.config['POST_WRITE_TIMEOUT']
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self.batches = 0
+        self.posts = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    def _start(self):
+        # Started on first use, and again in a process forked from this one:
+        # threads don't survive a fork
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() \
+                    or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(
+                    target=self._run, name='post-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, user_id, body):
+        self._start()
+        future = Future()
+        self._queue.put((user_id, body, future))
+        return future
+
+    def write(self, user_id, body):
+        future = self.submit(user_id, body)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            self.timeouts += 1
+            # Fails once the thread took the post (set_running_or_notify_cancel)
+            if future.cancel():
+                raise WriteTimeout()
+            return None
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                # Withdrawn by a request that stopped waiting
+                if not item[2].set_running_or_notify_cancel():
+                    continue
+                batch = [item]
+                deadline = monotonic() + self.window
+                while len(batch) < self.batch_size:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._commit(batch)
+                        return
+                    if item[2].set_running_or_notify_cancel():
+                        batch.append(item)
+                self._commit(batch)
+
+    def _commit(self, batch):
+        # Imported here to avoid circular imports, models imports the app package
+        from app import db
+        from app.models import Post
+        try:
+            posts = [Post(user_id=user_id, body=body) for user_id, body, _ in batch]
+            db.session.add_all(posts)
+            # The ids are known after the flush, reading them after the
+            # commit would reload every post
+            db.session.flush()
+            ids = [post.id for post in posts]
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            if len(batch) > 1:
+                for item in batch:
+                    self._commit([item])
+            else:
+                self.failures += 1
+                self.app.logger.exception('Could not write a post')
+                batch[0][2].set_exception(error)
+            return
+        finally:
+            # Give the connection back to the pool between batches
+            db.session.remove()
+        self.batches += 1
+        self.posts += len(batch)
+        for (_, _, future), id in zip(batch, ids):
+            future.set_result(id)
+
+    def stop(self):
+        if self._thread is not None and self._pid == os.getpid() \
+                and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        return {'batches': self.batches, 'posts': self.posts,
+                'failures': self.failures, 'timeouts': self.timeouts,
+                'queued': self._queue.qsize() if self._queue is not None else 0}
+
+
+class PostWriter(object):
+    """Background thread that inserts the new posts in batches. The methods
+    use the queue of the current application
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        posts = app.extensions['post_writer'] = PostQueue(app)
+        # Commit what is still waiting when the process stops
+        atexit.register(posts.stop)
+
+    @staticmethod
+    def _posts():
+        return current_app.extensions['post_writer']
+
+    def submit(self, user_id, body):
+        """Queue a new post
+
+        Args:
+            user_id (int): id of the author
+            body (str): text of the post
+
+        Returns:
+            Future: its result is the id of the post once it's committed
+        """
+        return self._posts().submit(user_id, body)
+
+    def write(self, user_id, body):
+        """Queue a new post and wait until it's committed
+
+        Returns:
+            int: id of the post, or None when the post was still being
+                committed after POST_WRITE_TIMEOUT seconds
+
+        Raises:
+            WriteTimeout: the post was still in the queue after
+                POST_WRITE_TIMEOUT seconds, it won't be written
+        """
+        return self._posts().write(user_id, body)
+
+    def stop(self):
+        """Commit the queued posts and stop the thread"""
+        self._posts().stop()
+
+    def stats(self):
+        """Counters of the writer, for monitoring
+
+        Returns:
+            dict: committed batches and posts, failed posts, requests that
+                stopped waiting and queued posts
+        """
+        return self._posts().stats()
@@ -0,0 +1,266 @@
+"""Pre-forking server
+  flask serve runs the application in WORKERS processes, one per core by
+  default, that accept the connections of one shared listening socket.
+  Everything that can be shared is loaded before the fork: the application,
+  its modules and the compiled Jinja templates. The forked workers share
+  those memory pages copy-on-write instead of each building its own copy.
+  gc.freeze() moves the loaded objects out of the garbage collector's reach,
+  otherwise its passes would write to (and so copy) the shared pages.
+  The database engines are created by each worker on first use, connections
+  are never shared between processes.
+  A worker is replaced after MAX_REQUESTS requests (plus a random jitter so
+  the workers don't restart together) or when its resident memory goes over
+  MAX_MEMORY, which bounds the cost of leaks and fragmentation.
+  Each worker writes its counters (requests, errors, latency histogram,
+  memory) to its slot of a shared memory region mapped before the fork.
+  /server-status reads all the slots, whichever worker answers. A slot has
+  one writer, the reader can see a slot in the middle of an update: the
+  numbers are for monitoring, not accounting.
+  POSIX only (fork).
+"""
+import gc
+import json
+import logging
+import mmap
+import os
+import random
+import resource
+import signal
+import socket
+import struct
+import sys
+import time
+from time import perf_counter
+from flask import Response
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+from app import template_cache
+from app.metrics import BUCKETS, check_access
+
+# Slot of a worker: pid, generation, requests, requests of the current
+# process, 5xx responses, latency sum (seconds), resident memory (bytes)
+# and the latency histogram over metrics.BUCKETS (the last one is +Inf)
+SLOT = struct.Struct('qqQQQdQ' + 'Q' * (len(BUCKETS) + 1))
+
+
+def resident_memory():
+    """Resident set size of this process in bytes, shared pages included"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except OSError:
+        # Peak instead of current outside of Linux, kilobytes on Linux and
+        # bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class WorkerStats(object):
+    """Counters of the workers in an anonymous shared memory mapping
+
+    Args:
+        workers (int): number of slots
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        # An anonymous mapping is MAP_SHARED, the forked workers write to
+        # the same pages
+        self.memory = mmap.mmap(-1, SLOT.size * workers)
+
+    def read(self, index):
+        values = SLOT.unpack_from(self.memory, index * SLOT.size)
+        return {'worker': index, 'pid': values[0], 'generation': values[1],
+                'requests': values[2], 'process_requests': values[3],
+                'errors': values[4], 'latency_seconds': values[5],
+                'memory': values[6], 'latency_buckets': list(values[7:])}
+
+    def start(self, index, pid):
+        """A new worker takes the slot, the totals of the slot go on"""
+        values = list(SLOT.unpack_from(self.memory, index * SLOT.size))
+        values[0] = pid
+        values[1] += 1
+        values[3] = 0
+        SLOT.pack_into(self.memory, index * SLOT.size, *values)
+
+    def record(self, index, duration, status, memory):
+        values = list(SLOT.unpack_from(self.memory, index * SLOT.size))
+        values[2] += 1
+        values[3] += 1
+        if status >= 500:
+            values[4] += 1
+        values[5] += duration
+        values[6] = memory
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                values[7 + i] += 1
+                break
+        else:
+            values[-1] += 1
+        SLOT.pack_into(self.memory, index * SLOT.size, *values)
+
+    def stats(self):
+        """Totals of all the workers, for the metrics collectors
+
+        Returns:
+            dict: requests, 5xx responses, latency sum and worker restarts
+        """
+        slots = [self.read(index) for index in range(self.workers)]
+        return {'requests': sum(slot['requests'] for slot in slots),
+                'errors': sum(slot['errors'] for slot in slots),
+                'latency_seconds': sum(slot['latency_seconds'] for slot in slots),
+                'restarts': sum(max(slot['generation'] - 1, 0) for slot in slots)}
+
+    def view(self):
+        check_access()
+        return Response(json.dumps({
+            'buckets': list(BUCKETS) + ['+Inf'],
+            'workers': [self.read(index) for index in range(self.workers)]}),
+            mimetype='application/json')
+
+
+class PreforkServer(object):
+    """Master process of flask serve
+
+    Args:
+        app (Flask): the application, loaded in the master
+        host (str): address to listen on
+        port (int): port to listen on
+        workers (int): number of worker processes
+        max_requests (int): requests before a worker is replaced, 0 for never
+        max_requests_jitter (int): up to this many requests added at random
+            to max_requests, per worker
+        max_memory (int): resident memory in bytes before a worker is
+            replaced, 0 for no limit
+        timeout (int): seconds the workers get to finish their request on
+            shutdown
+        access_log (bool): log a line per request. Defaults to False
+    """
+
+    def __init__(self, app, host, port, workers, max_requests=0, max_requests_jitter=0,
+                 max_memory=0, timeout=30, access_log=False):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_memory = max_memory
+        self.timeout = timeout
+        self.access_log = access_log
+        self.stats = WorkerStats(workers)
+        # pid -> slot of the worker
+        self.children = {}
+        self.stopping = False
+        self.index = None
+
+    def preload(self):
+        """Load what the workers can share before forking"""
+        self.app.add_url_rule('/server-status', 'server_status', self.stats.view)
+        # The workers never check the template files, they serve what the
+        # master loaded here (from TEMPLATE_CACHE_DIR when it's filled)
+        self.app.jinja_env.auto_reload = False
+        loaded, errors = template_cache.compile_all(self.app)
+        for name, error in errors:
+            self.app.logger.error('Template %s: %s', name, error)
+        # Objects alive now are never scanned again by the garbage collector
+        gc.collect()
+        gc.freeze()
+
+    def serve(self):
+        """Listen, fork the workers and replace them until SIGINT or SIGTERM"""
+        self.socket = socket.create_server((self.host, self.port), backlog=2048)
+        # All the workers wait on this socket. The ones that lose the race
+        # for a connection get EAGAIN instead of blocking in accept()
+        self.socket.setblocking(False)
+        self.preload()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        while not self.stopping:
+            self.reap()
+            time.sleep(0.2)
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self.timeout
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.signal_workers(signal.SIGKILL)
+
+    def signal_workers(self, signum):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                # Exited, reap() forgets it
+                pass
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        """Forget the exited workers and start their replacements"""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            if index is not None and not self.stopping:
+                self.spawn(index)
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            return
+        # In the worker: never return into the master's code
+        status = 0
+        try:
+            self.run_worker(index)
+        except BaseException:
+            self.app.logger.exception('Worker %d failed', index)
+            status = 1
+        finally:
+            # os._exit() skips the atexit functions, they write what this
+            # worker still buffers (last_seen, new posts, error emails)
+            import atexit
+            atexit._run_exitfuncs()
+            os._exit(status)
+
+    def run_worker(self, index):
+        self.index = index
+        self.stats.start(index, os.getpid())
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        limit = self.max_requests + random.randint(0, self.max_requests_jitter) \
+            if self.max_requests else 0
+        self.handled = 0
+        self.memory = resident_memory()
+        if not self.access_log:
+            # werkzeug logs every request at INFO level
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server(self.host, self.port, self.wsgi_app, fd=self.socket.fileno())
+        # handle_request() returns at least every second to check the flags
+        server.timeout = 1
+        while not self.stopping and not (limit and self.handled >= limit) and \
+                not (self.max_memory and self.memory > self.max_memory):
+            server.handle_request()
+
+    def wsgi_app(self, environ, start_response):
+        """The application, timed until the response is sent"""
+        start = perf_counter()
+        status = []
+
+        def timed_start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split(' ', 1)[0]))
+            return start_response(status_line, headers, exc_info)
+
+        def done():
+            self.handled += 1
+            self.memory = resident_memory()
+            self.stats.record(self.index, perf_counter() - start,
+                              status[0] if status else 500, self.memory)
+        return ClosingIterator(self.app(environ, timed_start_response), done)
+
@@ -0,0 +1,239 @@
+"""Rate limiting of the login and registration attempts
+  Every failed login costs a full password hash (PASSWORD_HASH_METHOD), a
+  burst of credential stuffing can use all the CPU of the workers. The
+  attempts are counted per client IP and per username, a request over one of
+  the limits is answered 429 with a Retry-After header before the view runs:
+  no query, no hash.
+  The limits are "count/seconds" settings. They are checked with a sliding
+  window counter: the counts of the current and of the previous fixed windows
+  are kept, the previous one weighted by how much of it is still inside the
+  sliding window. Two numbers per key, and no burst of twice the limit at the
+  edge of two windows like with fixed windows.
+  POST /api/v1/tokens checks passwords too, it shares the counters of the
+  login form.
+  The counters live in a backend: in each process by default (every worker
+  of flask serve then allows the limit), or on a shared server (redis
+  protocol) so that the limits hold for the whole site. Behind a proxy the
+  client IP must be in REMOTE_ADDR (werkzeug's ProxyFix).
+  The backend, the rules and the counters of an application are kept in
+  app.extensions.
+"""
+import math
+import threading
+from collections import OrderedDict
+from time import time
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+# The shared backend is optional, only needed when RATE_LIMIT_BACKEND=redis
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def parse_rate(value):
+    """Read a "count/seconds" limit
+
+    Args:
+        value (str): like 10/60, 10 attempts per minute
+
+    Returns:
+        tuple: (count, seconds)
+    """
+    count, seconds = value.split('/')
+    count, seconds = int(count), float(seconds)
+    if count < 1 or seconds <= 0:
+        raise ValueError('Invalid rate limit {!r}'.format(value))
+    return count, seconds
+
+
+def sliding_window(previous, count, limit, fraction, window):
+    """Check one more hit against a sliding window counter
+
+    Args:
+        previous (int): hits of the previous fixed window
+        count (int): hits of the current fixed window
+        limit (int): hits allowed per window
+        fraction (float): part of the current fixed window already elapsed
+        window (float): seconds of a window
+
+    Returns:
+        float: 0 when the hit is allowed, else the seconds before it would be
+    """
+    if previous * (1 - fraction) + count + 1 <= limit:
+        return 0
+    if count < limit:
+        # The previous window weighs less and less as time goes
+        return (1 - (limit - 1 - count) / previous - fraction) * window
+    # Not before the next window, where the count of this one is the previous
+    return (1 - fraction + max(0, 1 - (limit - 1) / count)) * window
+
+
+class MemoryBackend(object):
+    """Counters of this process, bounded to maxsize keys
+
+    Args:
+        maxsize (int): keys kept before the least recently used is dropped
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key -> [window number, count, count of the previous window], most
+        # recently used at the end
+        self._counters = OrderedDict()
+
+    def __len__(self):
+        return len(self._counters)
+
+    def hit(self, key, limit, window):
+        """Count a hit when it's under the limit
+
+        Returns:
+            float: 0 when the hit is allowed, else the seconds to wait
+        """
+        now = time() / window
+        number = int(now)
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or counter[0] < number - 1:
+                counter = [number, 0, 0]
+            elif counter[0] == number - 1:
+                counter = [number, 0, counter[1]]
+            retry_after = sliding_window(counter[2], counter[1], limit, now - number, window)
+            if not retry_after:
+                counter[1] += 1
+            self._counters[key] = counter
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.maxsize:
+                self._counters.popitem(last=False)
+        return retry_after
+
+
+class RedisBackend(object):
+    """Counters shared by all the workers, on a redis compatible server. A
+    key per fixed window, expiring after the next one
+
+    Args:
+        client (object, optional): object with the mget() and pipeline()
+            methods of redis.Redis. Defaults to a client built from url
+        url (str, optional): redis://host:port/db of the server
+    """
+
+    def __init__(self, client=None, url=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError('RATE_LIMIT_BACKEND=redis needs the redis package')
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def hit(self, key, limit, window):
+        now = time() / window
+        number = int(now)
+        current = '{}:{}'.format(key, number)
+        count, previous = self.client.mget(current, '{}:{}'.format(key, number - 1))
+        retry_after = sliding_window(int(previous or 0), int(count or 0), limit,
+                                     now - number, window)
+        if not retry_after:
+            # Two workers can both read a count under the limit and both add
+            # to it, the limit can be passed by a few concurrent hits
+            pipeline = self.client.pipeline()
+            pipeline.incr(current)
+            pipeline.expire(current, int(math.ceil(window * 2)))
+            pipeline.execute()
+        return retry_after
+
+
+def _client_ip():
+    return request.remote_addr
+
+
+def _form_username():
+    # Usernames have at most 64 characters, longer values don't make more keys
+    return request.form.get('username', '')[:64] or None
+
+
+def _basic_auth_username():
+    auth = request.authorization
+    return auth.username[:64] if auth is not None and auth.username else None
+
+
+class Limits(object):
+    """Backend, rules and counters of the limiter of one application
+
+    Args:
+        app (Flask): the application
+    """
+
+    def __init__(self, app):
+        if app.config['RATE_LIMIT_BACKEND'] == 'redis':
+            self.backend = RedisBackend(url=app.config['RATE_LIMIT_URL'])
+        else:
+            self.backend = MemoryBackend(app.config['RATE_LIMIT_SIZE'])
+        login_ip = parse_rate(app.config['RATE_LIMIT_LOGIN_IP'])
+        login_username = parse_rate(app.config['RATE_LIMIT_LOGIN_USERNAME'])
+        # endpoint -> (counters group, [(key kind, key function, limit)])
+        self.rules = {
+            'auth.login': ('login', [('ip', _client_ip, login_ip),
+                                     ('username', _form_username, login_username)]),
+            'api.get_token': ('login', [('ip', _client_ip, login_ip),
+                                        ('username', _basic_auth_username, login_username)]),
+            'auth.register': ('register', [
+                ('ip', _client_ip, parse_rate(app.config['RATE_LIMIT_REGISTER_IP']))]),
+        }
+        self.allowed = 0
+        # Rejected requests per key kind
+        self.rejected = {'ip': 0, 'username': 0}
+
+    def check(self):
+        """Answer 429 to the attempts over a limit"""
+        if request.method != 'POST' or request.endpoint not in self.rules or \
+                not current_app.config['RATE_LIMIT_ENABLED']:
+            return
+        group, rules = self.rules[request.endpoint]
+        for kind, key, (limit, window) in rules:
+            value = key()
+            if value is None:
+                continue
+            retry_after = self.backend.hit(
+                'microblog:rate:{}:{}:{}'.format(group, kind, value), limit, window)
+            if retry_after:
+                self.rejected[kind] += 1
+                raise TooManyRequests(retry_after=max(1, int(math.ceil(retry_after))))
+        self.allowed += 1
+
+    def stats(self):
+        stats = {'allowed': self.allowed,
+                 'rejected': sum(self.rejected.values()),
+                 'rejected_ip': self.rejected['ip'],
+                 'rejected_username': self.rejected['username']}
+        if isinstance(self.backend, MemoryBackend):
+            stats['keys'] = len(self.backend)
+        return stats
+
+
+class RateLimiter(object):
+    """Limits of the login and registration attempts, checked before the views
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        limits = app.extensions['rate_limit'] = Limits(app)
+        # Before the before_app_request functions of the blueprints, which
+        # load the current user
+        app.before_request(limits.check)
+
+    def stats(self):
+        """Counters of the limiter of the current application, for monitoring
+
+        Returns:
+            dict: allowed and rejected attempts, and keys (in-process backend)
+        """
+        return current_app.extensions['rate_limit'].stats()
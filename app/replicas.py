@@ -0,0 +1,244 @@
+"""Read replicas
+  The pages mostly read: timelines, profiles, the user loader, the checks of
+  the registration form. With DATABASE_REPLICA_URLS set, the session sends
+  those SELECTs to one of the replicas and everything else to the primary
+  database:
+  - the flushes (INSERT, UPDATE, DELETE) and the statements that are not a
+    SELECT (Core DML run with db.session.execute, raw SQL) always go to the
+    primary
+  - once a session has written, the rest of its reads go to the primary too,
+    so a request sees its own changes
+  - the reads in a "with db.session().primary_reads():" block go to the
+    primary, for the ones that must not see a lagging copy
+  - after a request that committed changes, the same browser reads from the
+    primary for DATABASE_READ_YOUR_WRITES seconds, the time the replicas
+    need to catch up
+  - outside of requests (flask commands, background threads) only the
+    primary is used
+  A replica is checked with SELECT 1 every DATABASE_REPLICA_CHECK_INTERVAL
+  seconds, and right away when one of its queries fails. While it's down the
+  reads go to the other replicas, or to the primary. The replica engines are
+  created by the first read that could use them. Each application has its
+  own replicas, kept in app.extensions.
+
+  To try it locally with two SQLite files (nothing copies the new rows to
+  the replica, which makes the read-your-writes window easy to see):
+  $ cp app.db replica.db
+  $ export DATABASE_REPLICA_URLS=sqlite:///$PWD/replica.db
+"""
+import random
+import threading
+from contextlib import contextmanager
+from time import monotonic, time
+from flask import current_app, has_app_context, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.exc import SQLAlchemyError
+from app.database import engine_options, tune_engine
+
+
+class Replica(object):
+    """Engine of a replica and its health"""
+
+    def __init__(self, url):
+        self.url = url
+        self.engine = None
+        self.healthy = True
+        # Checked before its first use
+        self.checked = float('-inf')
+        self.reads = 0
+        self.failures = 0
+
+
+def is_read(clause):
+    """True for the statements that can go to a replica: ORM and Core
+    SELECTs, and text() that starts with SELECT"""
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return getattr(clause, 'is_select', False)
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the replicas when it's safe"""
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        # Set after the first write, the rest of the session uses the primary
+        self.wrote = False
+        # Depth of the primary_reads() blocks
+        self._primary = 0
+
+    @contextmanager
+    def primary_reads(self):
+        """Send the reads of the block to the primary"""
+        self._primary += 1
+        try:
+            yield self
+        finally:
+            self._primary -= 1
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super().get_bind(mapper, clause)
+        # The flushes, the Core DML and anything else that isn't a SELECT
+        # (session.connection() has no clause) write, or could
+        if self._flushing or not is_read(clause):
+            self.wrote = True
+            return primary
+        replicas = self.app.extensions.get('replicas')
+        if replicas is None or self.wrote or self._primary:
+            return primary
+        # Only the tables of the default database are replicated
+        if primary is not self.app.extensions['sqlalchemy'].db.engine:
+            return primary
+        return replicas.read_engine() or primary
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose session is a RoutingSession and whose engines get the
+    SQLite pragmas of app/database.py"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        # Called on first use of db.engine, before any connection is opened,
+        # so the listener sees the first connection too
+        engine = super().create_engine(sa_url, engine_opts)
+        tune_engine(engine, self.get_app().config)
+        return engine
+
+
+class ReplicaSet(object):
+    """Replicas of one application and their health checks
+
+    Args:
+        app (Flask): the application
+        urls (list): database URLs of the replicas
+    """
+
+    def __init__(self, app, urls):
+        self.config = app.config
+        self.check_interval = app.config['DATABASE_REPLICA_CHECK_INTERVAL']
+        self.window = app.config['DATABASE_READ_YOUR_WRITES']
+        self.logger = app.logger
+        self.replicas = [Replica(url) for url in urls]
+        self._lock = threading.Lock()
+        self.primary_reads = 0
+
+    def _connect(self, replica):
+        engine = create_engine(replica.url, **engine_options(replica.url, self.config))
+        tune_engine(engine, self.config)
+        # A failing query takes the replica out until the next check
+        event.listen(engine, 'handle_error', self._failed(replica))
+        replica.engine = engine
+
+    def _failed(self, replica):
+        def handle_error(context):
+            replica.failures += 1
+            replica.healthy = False
+            replica.checked = monotonic()
+            self.logger.warning('Replica %s failed: %s', replica.url,
+                                context.original_exception)
+        return handle_error
+
+    def mark_write(self):
+        if has_request_context():
+            session['primary_until'] = time() + self.window
+
+    def _check(self, replica):
+        try:
+            with replica.engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+        except SQLAlchemyError:
+            # handle_error already marked it as down
+            return
+        if not replica.healthy:
+            self.logger.info('Replica %s is back', replica.url)
+        replica.healthy = True
+
+    def read_engine(self):
+        """Engine of a healthy replica for the current request
+
+        Returns:
+            Engine: the engine, or None when the read must go to the primary
+        """
+        if not has_request_context() or session.get('primary_until', 0) > time():
+            self.primary_reads += 1
+            return None
+        now = monotonic()
+        for replica in self.replicas:
+            # One thread checks a replica, the others use the last result
+            with self._lock:
+                if replica.engine is None:
+                    self._connect(replica)
+                due = now - replica.checked >= self.check_interval
+                if due:
+                    replica.checked = now
+            if due:
+                self._check(replica)
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            self.primary_reads += 1
+            return None
+        replica = random.choice(healthy)
+        replica.reads += 1
+        return replica.engine
+
+    def stats(self):
+        return {'primary_reads': self.primary_reads,
+                'replica_reads': sum(replica.reads for replica in self.replicas),
+                'healthy': sum(replica.healthy for replica in self.replicas),
+                'failures': sum(replica.failures for replica in self.replicas)}
+
+
+class Replicas(object):
+    """Replica engines and their health checks
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+        db (RoutingSQLAlchemy, optional): database of the application
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        urls = [url.strip() for url in
+                (app.config['DATABASE_REPLICA_URLS'] or '').split(',') if url.strip()]
+        if not urls:
+            return
+        app.extensions['replicas'] = ReplicaSet(app, urls)
+        # db.session is shared by the applications of the factory
+        if not event.contains(db.session, 'after_commit', self._committed):
+            event.listen(db.session, 'after_commit', self._committed)
+
+    @staticmethod
+    def _replicas():
+        if not has_app_context():
+            return None
+        return current_app.extensions.get('replicas')
+
+    def _committed(self, db_session):
+        if db_session.wrote:
+            self.mark_write()
+
+    def mark_write(self):
+        """Send the reads of this browser to the primary for a while, for
+        the writes made outside of the request session"""
+        replicas = self._replicas()
+        if replicas is not None:
+            replicas.mark_write()
+
+    def stats(self):
+        """Counters of the routing, for monitoring
+
+        Returns:
+            dict: reads sent to the primary and to the replicas, healthy
+                replicas and replica failures
+        """
+        replicas = self._replicas()
+        if replicas is None:
+            return {'primary_reads': 0, 'replica_reads': 0, 'healthy': 0, 'failures': 0}
+        return replicas.stats()
@@ -0,0 +1,81 @@
+"""Compiled templates cache
+  Jinja turns a template into Python code and compiles it the first time a
+  process renders it, which is most of the time of the first pages served by
+  a new worker. The compiled code is stored in TEMPLATE_CACHE_DIR, where the
+  other processes load it instead of compiling the template again. An entry
+  is keyed by the template path and checked against a checksum of the
+  source, an edited template is compiled again.
+  flask compile-templates fills the directory at deploy time, so the workers
+  start without compiling anything.
+  With TEMPLATES_AUTO_RELOAD off (the default outside of debug mode) a
+  template is loaded once per process, the files are not checked for changes
+  at every render.
+"""
+import os
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache for several processes writing the same
+    directory. A directory that can't be written costs a compile, not an
+    error page"""
+
+    def dump_bytecode(self, bucket):
+        path = self._get_cache_filename(bucket)
+        # Write to a temporary name and rename, readers never see half a file
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(temporary, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(temporary, path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+
+class TemplateCache(object):
+    """Bytecode cache of the Jinja environment of the application
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        directory = app.config['TEMPLATE_CACHE_DIR']
+        if not directory:
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            app.logger.warning('Template cache %s not available, the templates are '
+                               'compiled by every process', directory)
+            return
+        app.jinja_env.bytecode_cache = SharedBytecodeCache(directory)
+
+    def compile_all(self, app):
+        """Load every template of the application, compiling the ones that
+        are not in the cache yet
+
+        Args:
+            app (Flask): the application
+
+        Returns:
+            tuple: (number of templates loaded, list of (name, error) tuples
+                for the templates that don't compile)
+        """
+        env = app.jinja_env
+        loaded, errors = 0, []
+        for name in env.list_templates():
+            try:
+                # Kept in the environment cache of this process too
+                env.get_template(name)
+                loaded += 1
+            except TemplateError as error:
+                errors.append((name, error))
+        return loaded, errors
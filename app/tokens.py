@@ -0,0 +1,75 @@
+"""API tokens
+  Service clients authenticate with "Authorization: Bearer <token>" instead
+  of a session cookie. A token is the user id and the user's token_version,
+  signed with SECRET_KEY and dated, so checking it is an HMAC and a date
+  comparison, no database query and no password hash.
+  The user behind a valid token is loaded through the user cache, which
+  also has its token_version: incrementing user.token_version revokes all
+  the tokens issued before. The commit invalidates the cache entry of the
+  user, in this process or in all of them with USER_CACHE_BACKEND=redis.
+  With the in-process cache, other processes accept the old tokens until
+  their entry expires (USER_CACHE_TTL).
+  Each application signs with its own SECRET_KEY, the serializer is kept in
+  app.extensions.
+"""
+from flask import current_app
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+
+class TokenAuth(object):
+    """Issues and checks the signed API tokens
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # The salt keeps these signatures apart from the other uses of
+        # SECRET_KEY, a session cookie is not a valid token
+        app.extensions['tokens'] = URLSafeTimedSerializer(app.config['SECRET_KEY'],
+                                                          salt='api-token')
+
+    @property
+    def serializer(self):
+        """Serializer of the current application"""
+        return current_app.extensions['tokens']
+
+    def issue(self, user):
+        """New token for a user, valid for API_TOKEN_EXPIRATION seconds
+
+        Args:
+            user (User): owner of the token
+
+        Returns:
+            str: the token
+        """
+        return self.serializer.dumps([user.id, user.token_version])
+
+    def verify(self, token):
+        """Check the signature and the age of a token
+
+        Args:
+            token (str): token sent by the client
+
+        Returns:
+            tuple: (user id, token version), or None for an invalid or
+                expired token
+        """
+        try:
+            user_id, version = self.serializer.loads(
+                token, max_age=current_app.config['API_TOKEN_EXPIRATION'])
+        except (SignatureExpired, BadSignature, ValueError, TypeError):
+            return None
+        return user_id, version
+
+
+def bearer_token(request):
+    """Token of the Authorization: Bearer header, or None"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return token.strip()
@@ -0,0 +1,207 @@
+"""User loader cache
+  Flask-Login calls the user loader on every request and it used to run
+  User.query.get() each time, the most frequent query of the app. UserCache
+  keeps the column values of recently seen users for USER_CACHE_TTL seconds
+  and rebuilds the User object from them without a query.
+  The values live in a backend: an in-process LRU by default, or a shared
+  server (redis protocol) so that all the workers see the same entries and
+  the same invalidations. Entries are JSON, dates as ISO 8601 strings: a
+  value read from a shared server is only data, never code to run. The
+  password hash is not cached, the views that check a password load it
+  from the database.
+  The backend and the counters belong to one application, they are kept in
+  app.extensions.
+"""
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from time import monotonic
+from flask import current_app
+from sqlalchemy import DateTime, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+# The shared backend is optional, only needed when USER_CACHE_BACKEND=redis
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Columns left out of the entries
+UNCACHED_COLUMNS = frozenset(['password_hash'])
+
+
+class LRUBackend(object):
+    """In-process cache with a maximum number of entries and a TTL
+
+    Args:
+        maxsize (int): entries kept before the least recently used is evicted
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key -> (expires, value), most recently used at the end
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend(object):
+    """Cache shared by all the workers, on a redis compatible server
+
+    Args:
+        client (object, optional): object with the get(), set(ex=) and
+            delete() methods of redis.Redis. A local redis-server or any
+            stand-in with those methods can be passed here. Defaults to a
+            client built from url
+        url (str, optional): redis://host:port/db of the server
+    """
+
+    def __init__(self, client=None, url=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError('USER_CACHE_BACKEND=redis needs the redis package')
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+class CacheState(object):
+    """Backend and counters of the cache of one application"""
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+class UserCache(object):
+    """Cache of User rows in front of the Flask-Login user loader
+
+    Args:
+        app (Flask, optional): application to configure now. Defaults to None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['USER_CACHE_BACKEND'] == 'redis':
+            backend = RedisBackend(url=app.config['USER_CACHE_URL'])
+        else:
+            backend = LRUBackend(app.config['USER_CACHE_SIZE'])
+        app.extensions['user_cache'] = CacheState(backend, app.config['USER_CACHE_TTL'])
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['user_cache']
+
+    @staticmethod
+    def _key(id):
+        return 'microblog:user:{}'.format(id)
+
+    def load(self, id):
+        """Return the User with this id, from the cache when possible
+
+        Args:
+            id (int): primary key of the user
+
+        Returns:
+            User: the user attached to the current db session, or None
+        """
+        # Imported here to avoid circular imports, models imports the app package
+        from app import db
+        from app.models import User
+        state = self._state()
+        values = state.backend.get(self._key(id))
+        if values is None:
+            state.misses += 1
+            # Refilled from the primary: after an invalidation a lagging
+            # replica could still have the old row and cache it again
+            with db.session().primary_reads():
+                user = User.query.get(id)
+            if user is not None:
+                state.backend.set(self._key(id), self._values(user), state.ttl)
+            return user
+        state.hits += 1
+        # Build the object without __init__ and validators, the values are
+        # set as if they were loaded from the database. The columns that are
+        # not in the entry are loaded on first access
+        mapper = inspect(User)
+        user = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            if attr.key in values:
+                value = values[attr.key]
+                if value is not None and isinstance(attr.columns[0].type, DateTime):
+                    value = datetime.fromisoformat(value)
+                set_committed_value(user, attr.key, value)
+        # The object now looks like it was loaded from the database, merge()
+        # adds it to the session without a SELECT
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    @staticmethod
+    def _values(user):
+        # The column values of an entry, JSON types only
+        values = {}
+        for attr in inspect(user).mapper.column_attrs:
+            if attr.key in UNCACHED_COLUMNS:
+                continue
+            value = getattr(user, attr.key)
+            values[attr.key] = value.isoformat() if isinstance(value, datetime) else value
+        return values
+
+    def invalidate(self, id):
+        state = self._state()
+        state.invalidations += 1
+        state.backend.delete(self._key(id))
+
+    def stats(self):
+        """Counters of the cache, for monitoring
+
+        Returns:
+            dict: hits, misses, invalidations and size (in-process backend)
+        """
+        state = self._state()
+        stats = {'hits': state.hits, 'misses': state.misses,
+                 'invalidations': state.invalidations}
+        if isinstance(state.backend, LRUBackend):
+            stats['size'] = len(state.backend)
+        return stats
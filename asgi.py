@@ -0,0 +1,7 @@
+# ASGI entry point, for uvicorn or any other ASGI server:
+# $ uvicorn asgi:application
+# The API reads run on the event loop, the rest on the Flask app, see app/asgi.py
+from app import create_app
+from app.asgi import AsyncApp
+
+application = AsyncApp(create_app())
@@ -0,0 +1,219 @@
+"""Throughput and latency of the ASGI mode against the WSGI mode
+  Serves the application twice, one server process at a time:
+    wsgi  the Flask application on werkzeug's threaded server (a thread per
+          connection, every query blocks its thread)
+    asgi  asgi.py on uvicorn (the API reads run on the event loop with the
+          async engine, see app/asgi.py)
+  and sends the API reads (/api/v1/timeline, /api/v1/users/<username> and
+  /api/v1/users/<username>/posts) with a bearer token from --concurrency
+  keep-alive connections at once. For each mode and route it reports the
+  requests per second and the p50/p95/p99 latency.
+  Without --database a temporary SQLite database is created, migrated and
+  filled with flask seed. Everything runs offline, uvicorn and aiosqlite
+  must be installed.
+
+  $ python benchmarks/asgi_concurrency.py --concurrency 200 --json asgi.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    # Keep-alive (HTTP/1.1) like uvicorn, and no access log
+    'wsgi': [sys.executable, '-c',
+             'import logging, sys\n'
+             'from werkzeug.serving import WSGIRequestHandler, make_server\n'
+             'from microblog import app\n'
+             'logging.getLogger("werkzeug").setLevel(logging.ERROR)\n'
+             'WSGIRequestHandler.protocol_version = "HTTP/1.1"\n'
+             'make_server("127.0.0.1", int(sys.argv[1]), app, threaded=True).serve_forever()'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+             '--log-level', 'warning', '--no-access-log', '--port'],
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, env):
+    """Start a server process and wait until it accepts connections
+
+    Returns:
+        tuple: (process, port)
+    """
+    port = free_port()
+    process = subprocess.Popen(SERVERS[mode] + [str(port)], cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit('the {} server did not start'.format(mode))
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit('the {} server did not start'.format(mode))
+
+
+class Connection(object):
+    """Minimal HTTP/1.1 keep-alive client over asyncio streams"""
+
+    def __init__(self, port, headers):
+        self.port = port
+        self.headers = ''.join('{}: {}\r\n'.format(*item) for item in headers.items())
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        """Send a GET and read the whole response
+
+        Returns:
+            int: status code
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.writer.write('GET {} HTTP/1.1\r\nHost: 127.0.0.1\r\n{}\r\n'.format(
+            path, self.headers).encode('latin-1'))
+        head = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(head[0].split()[1])
+        fields = dict(line.lower().split(': ', 1) for line in head[1:] if line)
+        if 'content-length' in fields:
+            await self.reader.readexactly(int(fields['content-length']))
+        elif fields.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+            fields['connection'] = 'close'
+        if fields.get('connection') == 'close' or \
+                head[0].startswith('HTTP/1.0') and fields.get('connection') != 'keep-alive':
+            self.writer.close()
+            self.writer = None
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def load(port, headers, path, requests, concurrency):
+    """Send requests GETs of path from concurrency connections
+
+    Returns:
+        tuple: (latencies in ms, statuses, elapsed seconds)
+    """
+    latencies, statuses = [], set()
+    remaining = [requests]
+
+    async def worker():
+        connection = Connection(port, headers)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                start = perf_counter()
+                statuses.add(await connection.get(path))
+                latencies.append((perf_counter() - start) * 1000)
+        finally:
+            connection.close()
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, perf_counter() - start
+
+
+def prepare(args, env):
+    """Create the database if needed, return a token and a busy username"""
+    path = args.database
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='microblog-bench-'), 'bench.db')
+    env['DATABASE_URL'] = os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    sys.path.insert(0, ROOT)
+    from app import create_app, tokens
+    from app.models import User
+    app = create_app()
+    if args.database is None:
+        from flask_migrate import upgrade
+        with app.app_context():
+            upgrade(directory=os.path.join(ROOT, 'migrations'))
+        result = app.test_cli_runner().invoke(args=[
+            'seed', '--users', str(args.users), '--posts', str(args.posts)])
+        if result.exit_code != 0:
+            raise SystemExit(result.output)
+    with app.app_context():
+        # The most followed user has the busiest profile, the user following
+        # the most people the busiest timeline
+        popular = User.query.order_by(User.follower_count.desc()).first()
+        reader = max(User.query.limit(200), key=lambda user: user.followed.count())
+        return path, tokens.issue(reader), popular.username
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='existing SQLite file to use instead of seeding one')
+    parser.add_argument('--users', type=int, default=2000, help='users to seed')
+    parser.add_argument('--posts', type=int, default=50000, help='posts to seed')
+    parser.add_argument('--concurrency', type=int, default=100, help='connections at once')
+    parser.add_argument('--requests', type=int, default=2000, help='measured requests per route')
+    parser.add_argument('--modes', default='wsgi,asgi', help='servers to measure')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    path, token, username = prepare(args, env)
+    headers = {'Authorization': 'Bearer ' + token}
+    routes = {'timeline': '/api/v1/timeline',
+              'profile': '/api/v1/users/' + username,
+              'posts': '/api/v1/users/{}/posts'.format(username)}
+
+    results = {}
+    for mode in args.modes.split(','):
+        process, port = start_server(mode, env)
+        try:
+            for name, route in routes.items():
+                # Warm up: connections, pools and caches
+                asyncio.run(load(port, headers, route, args.concurrency, args.concurrency))
+                latencies, statuses, elapsed = asyncio.run(
+                    load(port, headers, route, args.requests, args.concurrency))
+                result = results.setdefault(mode, {})[name] = {
+                    'requests': args.requests, 'statuses': sorted(statuses),
+                    'rps': args.requests / elapsed,
+                    'p50_ms': percentile(latencies, 0.50),
+                    'p95_ms': percentile(latencies, 0.95),
+                    'p99_ms': percentile(latencies, 0.99)}
+                print('{:<5} {:<9} {rps:>8.1f} req/s  p50 {p50_ms:>8.2f}  p95 {p95_ms:>8.2f}  '
+                      'p99 {p99_ms:>8.2f} ms  {statuses}'.format(mode, name, **result))
+        finally:
+            process.terminate()
+            process.wait()
+
+    report = {'machine': platform.machine(), 'python': platform.python_version(),
+              'cpus': os.cpu_count(), 'concurrency': args.concurrency,
+              'database': path, 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""HTTP benchmark of the main routes
+  Drives /login, /index, /user/<username>, /register and /edit_profile and
+  reports, for each route, the p50/p95/p99 latency, the requests per second
+  and the number of SQL queries per request.
+  By default the requests go through the Flask test client. With --server
+  they go over HTTP to a local threaded WSGI server.
+  Without --database a temporary SQLite database is created, migrated and
+  filled with flask seed. Everything runs offline.
+
+  $ python benchmarks/http_routes.py --json results.json
+  $ python benchmarks/http_routes.py --json new.json --baseline results.json
+  The second command exits with status 1 when a route got slower (p95) or
+  runs more queries than in the baseline.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class TestClient(object):
+    """Sends the requests with app.test_client()"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class HTTPClient(object):
+    """Sends the requests to a werkzeug server running in a thread"""
+
+    def __init__(self, app):
+        import logging
+        from werkzeug.serving import make_server
+        # No access log line for every request
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+        class NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None
+
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(
+                    self.base + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+
+def prepare_database(args):
+    """Point DATABASE_URL at the benchmark database, creating it if needed"""
+    path = args.database
+    create = path is None
+    if create:
+        path = os.path.join(tempfile.mkdtemp(prefix='microblog-bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    return path, create
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='existing SQLite file to use instead of seeding one')
+    parser.add_argument('--users', type=int, default=2000, help='users to seed')
+    parser.add_argument('--posts', type=int, default=50000, help='posts to seed')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per route')
+    parser.add_argument('--server', action='store_true', help='go through a local WSGI server')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p95 slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    path, create = prepare_database(args)
+    sys.path.insert(0, ROOT)
+    from flask_migrate import upgrade
+    from sqlalchemy import event
+    from app import create_app, db
+    from app.models import User
+    app = create_app()
+    # The forms are posted without rendering them first
+    app.config['WTF_CSRF_ENABLED'] = False
+    # Every login and registration comes from this machine, the limits of
+    # app/rate_limit.py would answer most of them 429
+    app.config['RATE_LIMIT_ENABLED'] = False
+    if create:
+        with app.app_context():
+            upgrade(directory=os.path.join(ROOT, 'migrations'))
+        result = app.test_cli_runner().invoke(args=[
+            'seed', '--users', str(args.users), '--posts', str(args.posts)])
+        if result.exit_code != 0:
+            raise SystemExit(result.output)
+    with app.app_context():
+        # The most followed user has the busiest profile page
+        username = User.query.order_by(User.follower_count.desc()).first().username
+
+    queries = [0]
+
+    def count(*args):
+        queries[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+
+    client = HTTPClient(app) if args.server else TestClient(app)
+    credentials = {'username': username, 'password': 'password'}
+    registrations = iter(range(10 ** 9))
+
+    def register():
+        n = next(registrations)
+        return ('POST', '/register', {
+            'username': 'bench{}-{}'.format(os.getpid(), n),
+            'email': 'bench{}-{}@example.com'.format(os.getpid(), n),
+            'password': 'password', 'password2': 'password'})
+
+    # name -> function returning (method, path, form data)
+    routes = {
+        'login': lambda: ('POST', '/login', credentials),
+        'index': lambda: ('GET', '/index', None),
+        'user': lambda: ('GET', '/user/' + username, None),
+        'register': register,
+        'edit_profile GET': lambda: ('GET', '/edit_profile', None),
+        'edit_profile POST': lambda: ('POST', '/edit_profile', {
+            'username': username, 'about_me': 'benchmark run'}),
+    }
+    # Log in once, the other routes need a session. /login and /register
+    # only work for anonymous users, they get their own client that logs out
+    # (not measured) before each request
+    client.request(*routes['login']())
+    anonymous = HTTPClient(app) if args.server else TestClient(app)
+
+    results = {}
+    for name, route in routes.items():
+        target = anonymous if name in ('login', 'register') else client
+
+        def send():
+            if target is anonymous:
+                target.request('GET', '/logout')
+            method, url, data = route()
+            queries[0] = 0
+            begin = perf_counter()
+            status = target.request(method, url, data)
+            return status, (perf_counter() - begin) * 1000
+
+        for _ in range(args.warmup):
+            send()
+        latencies, counts, statuses = [], [], set()
+        start = perf_counter()
+        for _ in range(args.requests):
+            status, latency = send()
+            statuses.add(status)
+            latencies.append(latency)
+            counts.append(queries[0])
+        elapsed = perf_counter() - start
+        # req/s of the whole loop, including the untimed logouts
+        results[name] = {
+            'requests': args.requests, 'statuses': sorted(statuses),
+            'rps': args.requests / elapsed,
+            'p50_ms': percentile(latencies, 0.50), 'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'queries_per_request': sum(counts) / len(counts)}
+        print('{:<18} {rps:>8.1f} req/s  p50 {p50_ms:>7.2f}  p95 {p95_ms:>7.2f}  '
+              'p99 {p99_ms:>7.2f} ms  {queries_per_request:>5.1f} queries  {statuses}'
+              .format(name, **results[name]))
+
+    report = {'machine': platform.machine(), 'python': platform.python_version(),
+              'mode': 'server' if args.server else 'test client',
+              'database': path, 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = []
+        for name, result in results.items():
+            old = baseline.get(name)
+            if old is None:
+                continue
+            if result['p95_ms'] > old['p95_ms'] * (1 + args.tolerance):
+                regressions.append('{}: p95 {:.2f} ms, was {:.2f} ms'.format(
+                    name, result['p95_ms'], old['p95_ms']))
+            if result['queries_per_request'] > old['queries_per_request']:
+                regressions.append('{}: {:.1f} queries per request, was {:.1f}'.format(
+                    name, result['queries_per_request'], old['queries_per_request']))
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Password hashing benchmark
+  Measures how many password checks (the CPU cost of a login) one core can do
+  with each hashing method, to choose PASSWORD_HASH_METHOD and to size the
+  number of workers.
+
+  $ python benchmarks/password_hashing.py
+  $ python benchmarks/password_hashing.py pbkdf2:sha256:100000 pbkdf2:sha256:600000 --json out.json
+"""
+import argparse
+import json
+import os
+import platform
+from time import perf_counter
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:50000',
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+]
+
+
+def measure(method, seconds):
+    """Check the same password for about `seconds` seconds
+
+    Returns:
+        dict: method, checks done, checks per second and ms per check
+    """
+    stored = generate_password_hash('correct horse battery staple', method=method)
+    checks = 0
+    start = perf_counter()
+    while True:
+        check_password_hash(stored, 'correct horse battery staple')
+        checks += 1
+        elapsed = perf_counter() - start
+        if elapsed >= seconds:
+            break
+    return {'method': method, 'checks': checks,
+            'per_second': checks / elapsed, 'ms_per_check': 1000 * elapsed / checks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('methods', nargs='*', default=DEFAULT_METHODS,
+                        help='werkzeug hashing methods to measure')
+    parser.add_argument('--seconds', type=float, default=2.0,
+                        help='time spent on each method')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print('{:<28} {:>12} {:>12}'.format('method', 'logins/s', 'ms/login'))
+    for method in args.methods:
+        result = measure(method, args.seconds)
+        results.append(result)
+        print('{method:<28} {per_second:>12.1f} {ms_per_check:>12.2f}'.format(**result))
+    print('Results are per core, {} cores here'.format(os.cpu_count()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'machine': platform.machine(), 'python': platform.python_version(),
+                       'cpu_count': os.cpu_count(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""Startup benchmark: import, create_app() and first request
+  Every worker, CLI command and test pays for the startup of the
+  application. Each run starts a fresh Python process that imports the app
+  package, builds an application with create_app() and serves its first
+  request (GET /login, which renders a template and a form) with the test
+  client. The report gives the median and the fastest of the runs for each
+  step and the number of modules the process imported.
+  The web startup must not import what only some commands need: the run
+  fails when one of the --forbid modules (Alembic and Flask-Migrate by
+  default, only the flask db commands use them) got imported.
+  With --importtime the slowest imports of one run are listed, from
+  python -X importtime.
+  No database is needed, the first request doesn't run a query.
+  The compiled templates are cached in a temporary TEMPLATE_CACHE_DIR, filled
+  by the first run (left out of the results): the measured runs are workers
+  started after flask compile-templates, they must not compile any template.
+  --no-template-cache measures workers that compile their templates.
+
+  $ python benchmarks/startup.py --json startup.json
+  $ python benchmarks/startup.py --baseline startup.json
+  The second command exits with status 1 when a step got slower than in the
+  baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = ('import', 'create_app', 'first_request', 'total')
+
+# Runs in the fresh process, prints the timings as JSON
+CHILD = '''
+import json, sys
+from time import perf_counter
+start = perf_counter()
+from app import create_app
+imported = perf_counter()
+app = create_app()
+created = perf_counter()
+# Templates compiled by the first request, none when they come from the cache
+compiled = []
+compile = app.jinja_env.compile
+app.jinja_env.compile = lambda source, name=None, *args, **kwargs: \
+    compiled.append(name) or compile(source, name, *args, **kwargs)
+status = app.test_client().get('/login').status_code
+done = perf_counter()
+print(json.dumps({
+    'import': imported - start, 'create_app': created - imported,
+    'first_request': done - created, 'total': done - start,
+    'status': status, 'compiled': compiled, 'modules': sorted(sys.modules)}))
+'''
+
+
+def run(env, importtime=False):
+    """Start the application in a new process
+
+    Args:
+        env (dict): environment of the process
+        importtime (bool, optional): run with -X importtime. Defaults to False
+
+    Returns:
+        tuple: (timings dict, stderr of the process)
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD]
+    process = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise SystemExit(process.stderr)
+    return json.loads(process.stdout.splitlines()[-1]), process.stderr
+
+
+def slowest_imports(stderr, count):
+    """Imports of the first two levels with the largest cumulative time
+
+    Args:
+        stderr (str): output of python -X importtime
+        count (int): number of imports to return
+
+    Returns:
+        list: (milliseconds, module) tuples, slowest first
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # The nesting of an import is shown by the indentation of its name.
+        # The first two levels are kept, the deeper ones are counted in them
+        if len(name) - len(name.lstrip()) <= 3:
+            imports.append((int(cumulative) / 1000.0, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='number of fresh processes')
+    parser.add_argument('--forbid', default='alembic,flask_migrate',
+                        help='comma-separated modules the startup must not import')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='list the N slowest imports of one run')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with the results of a previous --json run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown before a step counts as a regression (0.2 = 20%%)')
+    parser.add_argument('--no-template-cache', action='store_true',
+                        help='compile the templates in every run')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # Any database works, the first request doesn't open it
+    directory = tempfile.mkdtemp(prefix='microblog-startup-')
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'startup.db')
+    env['TEMPLATE_CACHE_DIR'] = '' if args.no_template_cache else \
+        os.path.join(directory, 'template_cache')
+    # The first run also compiles the .pyc files, it's left out
+    first, _ = run(env)
+    if first['status'] != 200:
+        raise SystemExit('GET /login answered {}'.format(first['status']))
+    runs = [run(env)[0] for _ in range(args.runs)]
+
+    results = {}
+    for step in STEPS:
+        values = [result[step] * 1000 for result in runs]
+        results[step] = {'median_ms': statistics.median(values), 'min_ms': min(values)}
+        print('{:<14} median {median_ms:>8.1f} ms  min {min_ms:>8.1f} ms'.format(
+            step, **results[step]))
+    modules = runs[0]['modules']
+    print('{} modules imported'.format(len(modules)))
+
+    compiled = runs[0]['compiled']
+    print('{} templates compiled by the first request'.format(len(compiled)) +
+          (': ' + ' '.join(compiled) if compiled else ''))
+    # With the cache the workers load the templates compiled by the first run
+    uncached = compiled if not args.no_template_cache else []
+    if uncached:
+        print('COMPILED templates were compiled despite the template cache')
+
+    forbidden = [name for name in args.forbid.split(',') if name and name in modules]
+    for name in forbidden:
+        print('FORBIDDEN {} is imported at startup'.format(name))
+
+    if args.importtime:
+        _, stderr = run(env, importtime=True)
+        print('slowest imports (cumulative):')
+        for milliseconds, name in slowest_imports(stderr, args.importtime):
+            print('  {:>8.1f} ms  {}'.format(milliseconds, name))
+
+    report = {'machine': platform.machine(), 'python': platform.python_version(),
+              'runs': args.runs, 'modules': len(modules), 'compiled': len(compiled),
+              'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for step, result in results.items():
+            old = baseline['results'].get(step)
+            if old is not None and result['median_ms'] > old['median_ms'] * (1 + args.tolerance):
+                regressions.append('{}: median {:.1f} ms, was {:.1f} ms'.format(
+                    step, result['median_ms'], old['median_ms']))
+        if len(modules) > baseline['modules']:
+            print('{} more modules than in the baseline'.format(
+                len(modules) - baseline['modules']))
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+    if forbidden or regressions or uncached:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,31 @@ class Config(object):
     # We put this to false because we don't need it now. It's to signal the app
     # every time a change is about to be made in the DB
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite pragmas set on every connection, see app/database.py. WAL lets
+    # the pages be read while another request commits
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'wal'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'normal'
+    # Milliseconds to wait for the write lock before "database is locked"
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
+    # Bytes of the database file read through mmap, 0 turns it off
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    # Connection pool, per process. Checking a connection out waits up to
+    # POOL_TIMEOUT seconds when POOL_SIZE + MAX_OVERFLOW are in use
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 10)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 20)
+    DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT') or 30)
+    # Server databases only: connections older than POOL_RECYCLE seconds are
+    # replaced, and PRE_PING tests each connection before using it (set it to
+    # 0 to skip the test)
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE') or 1800)
+    DATABASE_POOL_PRE_PING = (os.environ.get('DATABASE_POOL_PRE_PING') or '1') != '0'
+    # Comma separated URLs of read replicas of SQLALCHEMY_DATABASE_URI. The
+    # SELECTs of the requests go to them, see app/replicas.py
+    DATABASE_REPLICA_URLS = os.environ.get('DATABASE_REPLICA_URLS')
+    # Seconds between the health checks of a replica
+    DATABASE_REPLICA_CHECK_INTERVAL = int(os.environ.get('DATABASE_REPLICA_CHECK_INTERVAL') or 10)
+    # After writing, a browser reads from the primary for this many seconds
+    DATABASE_READ_YOUR_WRITES = int(os.environ.get('DATABASE_READ_YOUR_WRITES') or 5)
     # Add email server details to this configuration file
     MAIL_SERVER = os.getenv('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
@@ -27,3 +52,103 @@ class Config(object):
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['alexcoeari73@gmail.com']
+    # Error records waiting to be emailed, more are dropped (and counted)
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 100)
+    # Identical errors within this many seconds are sent as one summary email
+    MAIL_COALESCE_WINDOW = int(os.environ.get('MAIL_COALESCE_WINDOW') or 300)
+    # Number of posts shown in each page of a timeline
+    POSTS_PER_PAGE = int(os.environ.get('POSTS_PER_PAGE') or 25)
+    # Users with more followers than this are not fanned out on write, their
+    # followers read their posts at timeline read time instead
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or 10000)
+    # Number of recent posts copied into a timeline when following someone
+    TIMELINE_BACKFILL = int(os.environ.get('TIMELINE_BACKFILL') or 100)
+    # last_seen is only written again when it is older than this (seconds)
+    LAST_SEEN_GRANULARITY = int(os.environ.get('LAST_SEEN_GRANULARITY') or 60)
+    # Buffered last_seen values are written every FLUSH_INTERVAL seconds or
+    # when FLUSH_SIZE users are waiting, whatever comes first
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 10)
+    LAST_SEEN_FLUSH_SIZE = int(os.environ.get('LAST_SEEN_FLUSH_SIZE') or 100)
+    # Cache of the users loaded by Flask-Login. 'memory' is an LRU inside each
+    # process, 'redis' is shared by all the workers through USER_CACHE_URL
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND') or 'memory'
+    USER_CACHE_URL = os.environ.get('USER_CACHE_URL') or 'redis://localhost:6379/0'
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+    # 'gravatar' links the avatars to www.gravatar.com, 'local' renders the
+    # identicons in /avatar/<digest>/<size> and stores them in AVATAR_CACHE_DIR
+    AVATAR_SOURCE = os.environ.get('AVATAR_SOURCE') or 'gravatar'
+    AVATAR_CACHE_DIR = os.environ.get('AVATAR_CACHE_DIR') or \
+        os.path.join(basedir, 'avatar_cache')
+    # The only sizes /avatar serves, the ones the templates and the API use
+    AVATAR_SIZES = (36, 128)
+    # Images kept in AVATAR_CACHE_DIR, the oldest ones are removed beyond it
+    AVATAR_CACHE_MAX_FILES = int(os.environ.get('AVATAR_CACHE_MAX_FILES') or 100000)
+    # Seconds browsers can keep an avatar before asking again
+    AVATAR_MAX_AGE = int(os.environ.get('AVATAR_MAX_AGE') or 7 * 24 * 3600)
+    # Full-text search engine. When not set, SQLite databases use FTS5 and
+    # other databases have no search until a backend is registered for them
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+    SEARCH_RESULTS_PER_PAGE = int(os.environ.get('SEARCH_RESULTS_PER_PAGE') or 20)
+    # Compiled templates, shared by the processes and filled at deploy time
+    # by flask compile-templates. Empty to compile them in every process
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR',
+                                        os.path.join(basedir, 'template_cache'))
+    # Check the template files for changes at every render: 1 during
+    # development, 0 in production where a template is loaded once per
+    # process. Not set, it's on in debug mode only
+    TEMPLATES_AUTO_RELOAD = os.environ.get('TEMPLATES_AUTO_RELOAD')
+    if TEMPLATES_AUTO_RELOAD is not None:
+        TEMPLATES_AUTO_RELOAD = TEMPLATES_AUTO_RELOAD != '0'
+    # Memory used by the rendered posts cache, in bytes of UTF-8 HTML
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES') or 16 * 1024 * 1024)
+    # Password hashing, in werkzeug's method format. The last number is the
+    # work factor (pbkdf2 iterations), it sets the CPU cost of every login.
+    # Stored hashes made with other values are updated when the user logs in.
+    # benchmarks/password_hashing.py measures logins per second for each value
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:260000'
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH') or 16)
+    # Attempts allowed per client IP and per username, as count/seconds. The
+    # login form and POST /api/v1/tokens share the login limits. Over a limit
+    # the request is answered 429 before any query or password hash
+    RATE_LIMIT_ENABLED = (os.environ.get('RATE_LIMIT_ENABLED') or '1') != '0'
+    RATE_LIMIT_LOGIN_IP = os.environ.get('RATE_LIMIT_LOGIN_IP') or '30/60'
+    RATE_LIMIT_LOGIN_USERNAME = os.environ.get('RATE_LIMIT_LOGIN_USERNAME') or '10/60'
+    RATE_LIMIT_REGISTER_IP = os.environ.get('RATE_LIMIT_REGISTER_IP') or '10/3600'
+    # 'memory' counts in each process (each worker allows the limits), 'redis'
+    # shares the counters of all the workers through RATE_LIMIT_URL
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND') or 'memory'
+    RATE_LIMIT_URL = os.environ.get('RATE_LIMIT_URL') or 'redis://localhost:6379/0'
+    # Keys (IPs and usernames) kept by the memory backend
+    RATE_LIMIT_SIZE = int(os.environ.get('RATE_LIMIT_SIZE') or 100000)
+    # JSON API: posts per page, largest ?limit= and rows read per query when
+    # a list is streamed as NDJSON
+    API_PER_PAGE = int(os.environ.get('API_PER_PAGE') or 25)
+    API_MAX_PER_PAGE = int(os.environ.get('API_MAX_PER_PAGE') or 100)
+    API_STREAM_CHUNK = int(os.environ.get('API_STREAM_CHUNK') or 500)
+    # Seconds an API token is valid
+    API_TOKEN_EXPIRATION = int(os.environ.get('API_TOKEN_EXPIRATION') or 24 * 3600)
+    # ASGI mode (asgi.py). The async engine opens ASYNC_DATABASE_URL, by
+    # default DATABASE_URL with the asyncio driver of its backend (aiosqlite
+    # for SQLite). The WSGI views run in a pool of ASGI_THREADS threads
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS') or 32)
+    # New posts are inserted by a background thread, in one transaction per
+    # WINDOW seconds or BATCH_SIZE posts. The request waits up to TIMEOUT
+    # seconds for the commit
+    POST_WRITE_BATCH_SIZE = int(os.environ.get('POST_WRITE_BATCH_SIZE') or 50)
+    POST_WRITE_WINDOW = float(os.environ.get('POST_WRITE_WINDOW') or 0.005)
+    POST_WRITE_TIMEOUT = int(os.environ.get('POST_WRITE_TIMEOUT') or 10)
+    # Per-request query count, database and template time, served at /metrics
+    # in the Prometheus format. Off by default, nothing is hooked then
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED') is not None
+    # Adds a Server-Timing header with the same numbers to every response
+    METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING') is not None
+    # Queries slower than this (seconds) are logged, the last SAMPLES are kept
+    METRICS_SLOW_QUERY = float(os.environ.get('METRICS_SLOW_QUERY') or 0.1)
+    METRICS_SLOW_QUERY_SAMPLES = int(os.environ.get('METRICS_SLOW_QUERY_SAMPLES') or 50)
+    # /metrics and /server-status answer the comma separated addresses of
+    # METRICS_ALLOWED_IPS, and the requests with "Authorization: Bearer
+    # METRICS_TOKEN" when it's set. Anything else gets a 403
+    METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS') or '127.0.0.1,::1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
@@ -1,9 +1,11 @@
-# From app import app from app package import app and db variables
-# both created in __init__.py
-from app import app, db
+# Build the application with the factory in the app package, db is created
+# in __init__.py too
+from app import create_app, db
 # From models.py import User and Post class
 from app.models import User, Post
 
+app = create_app()
+
 # Creates the shell context that adds the database instance and models
 # to the shell extension. We use "flask shell"
 # The decorator registers the function as a shell context function.
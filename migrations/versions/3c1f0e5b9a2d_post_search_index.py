@@ -0,0 +1,34 @@
+"""post search index
+
+Revision ID: 3c1f0e5b9a2d
+Revises: 945825b1a43a
+Create Date: 2026-10-18 16:52:10.118542
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0e5b9a2d'
+down_revision = '945825b1a43a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 only exists in SQLite, other engines get their index from the
+    # search backend registered for them
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    # External content table: the index reads the text from post.body
+    op.execute("CREATE VIRTUAL TABLE post_fts USING fts5("
+               "body, content='post', content_rowid='id')")
+    # Index the posts that already exist
+    op.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TABLE post_fts")
@@ -0,0 +1,34 @@
+"""Fixtures of the tests
+  Each test gets its own application on a new SQLite file, with the schema
+  built from the models.
+"""
+import pytest
+from app import create_app, db
+from config import Config
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Factory of applications, each on its own SQLite file"""
+    def make_app(name='test', **settings):
+        class TestConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / (name + '.db'))
+            # Compiled templates are not written into the repository
+            TEMPLATE_CACHE_DIR = ''
+        for key, value in settings.items():
+            setattr(TestConfig, key, value)
+        app = create_app(TestConfig)
+        with app.app_context():
+            db.create_all()
+        return app
+    return make_app
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,30 @@
+"""The /avatar endpoint needs no login, it must not draw any size asked for
+or fill the disk with the images of made up digests
+"""
+import os
+import pytest
+
+DIGEST = '0123456789abcdef0123456789abcdef'
+
+
+@pytest.fixture
+def client(app, tmp_path):
+    app.config['AVATAR_CACHE_DIR'] = str(tmp_path / 'avatars')
+    return app.test_client()
+
+
+def test_only_page_sizes(client):
+    assert client.get('/avatar/{}/36'.format(DIGEST)).mimetype == 'image/png'
+    assert client.get('/avatar/{}/128'.format(DIGEST)).status_code == 200
+    assert client.get('/avatar/{}/512'.format(DIGEST)).status_code == 404
+    assert client.get('/avatar/{}/37'.format(DIGEST)).status_code == 404
+
+
+def test_cache_is_bounded(app, client):
+    # 256 directories of 2 images
+    app.config['AVATAR_CACHE_MAX_FILES'] = 512
+    for i in range(5):
+        digest = 'ab{:030x}'.format(i)
+        assert client.get('/avatar/{}/36'.format(digest)).status_code == 200
+    names = os.listdir(os.path.join(app.config['AVATAR_CACHE_DIR'], 'ab'))
+    assert len(names) == 2
@@ -0,0 +1,58 @@
+"""Applications of the same process don't share the state of the extensions
+  The extension objects of app/__init__.py are shared by every application
+  the factory creates, their caches, keys and threads must still belong to
+  one application.
+"""
+import pytest
+from app import db, post_writer, tokens, user_cache
+from app.models import Post, User
+
+
+@pytest.fixture
+def apps(make_app):
+    apps = []
+    for name in ('first', 'second'):
+        app = make_app(name, SECRET_KEY=name + '-key')
+        with app.app_context():
+            # Same id in both databases
+            db.session.add(User(username=name, email=name + '@example.com'))
+            db.session.commit()
+        apps.append(app)
+    yield apps
+    for app in apps:
+        with app.app_context():
+            post_writer.stop()
+            db.session.remove()
+            db.engine.dispose()
+
+
+def test_user_cache(apps):
+    first, second = apps
+    with first.app_context():
+        assert user_cache.load(1).username == 'first'
+    with second.app_context():
+        assert user_cache.load(1).username == 'second'
+        assert user_cache.stats()['misses'] == 1
+    with first.app_context():
+        assert user_cache.load(1).username == 'first'
+        assert user_cache.stats()['hits'] == 1
+
+
+def test_tokens(apps):
+    first, second = apps
+    with first.app_context():
+        token = tokens.issue(User.query.get(1))
+        assert tokens.verify(token) is not None
+    with second.app_context():
+        assert tokens.verify(token) is None
+
+
+def test_post_writer(apps):
+    first, second = apps
+    with second.app_context():
+        id = post_writer.write(1, 'to the second database')
+        assert Post.query.get(id).body == 'to the second database'
+        assert post_writer.stats()['posts'] == 1
+    with first.app_context():
+        assert Post.query.count() == 0
+        assert post_writer.stats()['posts'] == 0
@@ -0,0 +1,46 @@
+"""The profile and timeline queries must read through their indexes
+  The plans come from EXPLAIN QUERY PLAN on SQLite, a full scan of post,
+  timeline_entry or user, or a sort done by SQLite (TEMP B-TREE), fails the
+  test. flask check-query-plans shows the same plans on any database.
+"""
+from datetime import datetime
+import pytest
+from app import db
+from app.cli import BAD_PLAN, explain
+from app.models import User, post_authors_select
+
+PER_PAGE = 25
+
+
+@pytest.fixture
+def users(app):
+    alice, bob = User(username='alice', email='alice@example.com'), \
+        User(username='bob', email='bob@example.com')
+    db.session.add_all([alice, bob])
+    db.session.commit()
+    alice.follow(bob)
+    db.session.commit()
+    return alice, bob
+
+
+QUERIES = {
+    'profile': lambda user: (User.query.filter_by(username=user.username).first(),
+                             user.posts_page(None, PER_PAGE)),
+    'profile next page': lambda user: user.posts_page((datetime.utcnow(), 2 ** 31),
+                                                      PER_PAGE),
+    'timeline': lambda user: user.timeline(None, PER_PAGE),
+    'timeline next page': lambda user: user.timeline((datetime.utcnow(), 2 ** 31),
+                                                     PER_PAGE),
+    'timeline validators': lambda user: db.session.execute(
+        post_authors_select(list(range(1, PER_PAGE + 1)))).all(),
+}
+
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_query_uses_indexes(users, name):
+    alice, _ = users
+    plans = explain(lambda: QUERIES[name](alice))
+    assert plans, 'no SELECT was run'
+    for statement, plan in plans:
+        bad = [line for line in plan if BAD_PLAN.search(line)]
+        assert not bad, '{}\n{}'.format(' '.join(statement.split()), '\n'.join(plan))
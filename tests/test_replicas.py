@@ -0,0 +1,79 @@
+"""Read replica routing, with a primary and a replica SQLite file
+  Nothing copies the rows from the primary to the replica here. The replica
+  keeps an about_me of its own, so each read shows which database it came
+  from.
+"""
+import shutil
+import sqlite3
+from time import time
+import pytest
+from flask import session
+from app import db, replicas
+from app.models import User
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    replica = tmp_path / 'replica.db'
+    app = make_app('primary', DATABASE_REPLICA_URLS='sqlite:///' + str(replica))
+    with app.app_context():
+        db.session.add(User(username='alice', email='alice@example.com',
+                            about_me='primary'))
+        db.session.commit()
+        db.engine.dispose()
+    shutil.copy(str(tmp_path / 'primary.db'), str(replica))
+    with sqlite3.connect(str(replica)) as connection:
+        connection.execute("UPDATE user SET about_me = 'replica'")
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def read(username='alice'):
+    # A new session each time, the identity map would answer otherwise
+    db.session.remove()
+    return User.query.filter_by(username=username).first().about_me
+
+
+def test_reads_go_to_the_replica(app):
+    with app.test_request_context():
+        assert read() == 'replica'
+        assert replicas.stats()['replica_reads'] == 1
+
+
+def test_reads_after_a_write_go_to_the_primary(app):
+    with app.test_request_context():
+        db.session.remove()
+        db.session.add(User(username='bob', email='bob@example.com'))
+        db.session.flush()
+        assert User.query.filter_by(username='alice').first().about_me == 'primary'
+        db.session.rollback()
+
+
+def test_read_your_writes_window(app):
+    with app.test_request_context():
+        db.session.remove()
+        db.session.add(User(username='bob', email='bob@example.com'))
+        db.session.commit()
+        # Set by the commit, the next requests of this browser use the primary
+        assert session['primary_until'] > time()
+        assert read() == 'primary'
+        assert User.query.filter_by(username='bob').first() is not None
+        session['primary_until'] = time() - 1
+        assert read() == 'replica'
+
+
+def test_outside_requests_only_the_primary(app):
+    with app.app_context():
+        assert read() == 'primary'
+
+
+def test_unhealthy_replica_falls_back_to_the_primary(app, tmp_path):
+    with app.app_context():
+        replica = app.extensions['replicas'].replicas[0]
+    # The file can't be opened, the health check fails
+    replica.url = 'sqlite:///' + str(tmp_path / 'missing' / 'replica.db')
+    with app.test_request_context():
+        assert read() == 'primary'
+        assert not replica.healthy
+        assert replicas.stats()['healthy'] == 0
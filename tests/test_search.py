@@ -0,0 +1,14 @@
+"""A schema built by db.create_all() has the search index of the posts"""
+from app import db, search
+from app.models import User, Post
+
+
+def test_created_posts_are_searchable(app):
+    user = User(username='alice', email='alice@example.com')
+    db.session.add(user)
+    db.session.add_all([Post(body='flask and sqlite', author=user),
+                        Post(body='coffee time', author=user)])
+    db.session.commit()
+    ids, total = search.search('sqlite', 1, 10)
+    assert total == 1
+    assert db.session.get(Post, ids[0]).body == 'flask and sqlite'
@@ -0,0 +1,56 @@
+"""The user cache stores plain JSON data in a shared server
+  A value read back from redis is decoded with json, never unpickled, and the
+  password hash stays in the database.
+"""
+import json
+from datetime import datetime
+import pytest
+from app import db, user_cache
+from app.models import User
+from app.user_cache import RedisBackend
+
+
+class FakeRedis(object):
+    """The get(), set(ex=) and delete() methods of redis.Redis, in a dict"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def client(app):
+    client = FakeRedis()
+    app.extensions['user_cache'].backend = RedisBackend(client=client)
+    user = User(username='alice', email='alice@example.com',
+                last_seen=datetime(2024, 5, 1, 12, 30, 15, 250))
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return client
+
+
+def test_entries_are_json_without_password_hash(client):
+    assert user_cache.load(1).username == 'alice'
+    values = json.loads(client.data['microblog:user:1'])
+    assert values['username'] == 'alice'
+    assert values['last_seen'] == '2024-05-01T12:30:15.000250'
+    assert 'password_hash' not in values
+
+
+def test_user_rebuilt_from_entry(client):
+    user_cache.load(1)
+    db.session.remove()
+    user = user_cache.load(1)
+    assert user_cache.stats()['hits'] == 1
+    assert user.last_seen == datetime(2024, 5, 1, 12, 30, 15, 250)
+    # Loaded from the database on first access
+    assert user.check_password('secret')